@@ -145,10 +145,10 @@ def main(config):
         asset_df = gpd.read_file(os.path.join(processed_data_path,asset_info.path),layer=asset_info.asset_layer)
         asset_df = asset_df.to_crs(epsg=epsg)
         
-        exposure_df = pd.read_csv(os.path.join(results_data_path,
+        exposure_df = pd.read_parquet(os.path.join(results_data_path,
                                             "risk_results",
                                             "direct_damages_summary",
-                                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_exposures.csv"))
+                                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_exposures.parquet"))
         exposure_columns = [c for c in exposure_df.columns.values.tolist() if c not in [asset_id,"exposure_unit"]]
         exposure_df["max_exposure_m"] = exposure_df[exposure_columns].max(axis=1)
         asset_df = pd.merge(exposure_df[[asset_id,"max_exposure_m"]],asset_df,how="left",on=[asset_id])
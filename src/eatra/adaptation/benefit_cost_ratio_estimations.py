@@ -71,7 +71,7 @@ def get_risk_and_adaption_columns(dataframe_columns):
     bcr_columns = [c.replace("EAD","BCR") for c in EAD_columns]
     return EAD_columns, EAEL_columns, benefit_columns, bcr_columns
 
-def main(config):
+def main(config,export_csv=True):
     incoming_data_path = config['paths']['incoming_data']
     processed_data_path = config['paths']['data']
     results_data_path = config['paths']['results']
@@ -99,23 +99,25 @@ def main(config):
                 cost_file = os.path.join(hazard_adapt_costs,
                                             f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_adaptation_timeseries_and_npvs.csv")
                 no_adapt_risk_file = os.path.join(non_adapt_risk_results,
-                                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL_npvs.csv")
+                                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL_npvs.parquet")
                 if (os.path.isfile(cost_file) is True) and (os.path.isfile(no_adapt_risk_file) is True):
                     print (f"* Starting with {option['option']} {asset_info.asset_gpkg} {asset_info.asset_layer}")
                     cost_df = pd.read_csv(cost_file)
                     adapt_costs_df = cost_df[cost_df["adaptation_option"] == option["option_name"]]
                     if len(adapt_costs_df.index) > 0:
                         adapt_costs_df = adapt_costs_df[[asset_id, "adaptation_option","adapt_cost_npv"]]
-                        no_adapt_risk_df = pd.read_csv(no_adapt_risk_file)
-                        adapt_risk_df = pd.read_csv(os.path.join(
+                        adapt_risk_df = pd.read_parquet(os.path.join(
                                                     option_results_folder,
-                                                    f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL_npvs.csv"))
+                                                    f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL_npvs.parquet"))
                         
                         EAD_columns, EAEL_columns, benefit_columns, bcr_columns = get_risk_and_adaption_columns(adapt_risk_df.columns.values.tolist())
                         
                         adapt_ids = adapt_risk_df[asset_id].values.tolist()
 
-                        no_adapt_risk_df = no_adapt_risk_df[no_adapt_risk_df[asset_id].isin(adapt_ids)]
+                        # Only read the risks of the adapted assets
+                        no_adapt_risk_df = pd.read_parquet(no_adapt_risk_file,
+                                                    columns=[asset_id] + EAD_columns + EAEL_columns,
+                                                    filters=[(asset_id,"in",adapt_ids)])
                         adapt_costs_df = adapt_costs_df[adapt_costs_df[asset_id].isin(adapt_ids)]
 
                         no_adapt_risk_df = no_adapt_risk_df[[asset_id] + EAD_columns + EAEL_columns].set_index(asset_id)
@@ -151,13 +153,13 @@ def main(config):
             if len(asset_adaptation_df) > 0:
                 asset_adaptation_df = pd.concat(asset_adaptation_df,axis=0,ignore_index=False)
 
-                asset_adaptation_df.to_csv(os.path.join(adaptation_bcr_results,
-                    f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_adaptation_benefits_costs_bcr_{days}_days_disruption.csv"),
-                    index=False)
-
                 asset_adaptation_df.to_parquet(os.path.join(adaptation_bcr_results,
                     f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_adaptation_benefits_costs_bcr_{days}_days_disruption.parquet"),
                     index=False)
+                if export_csv is True:
+                    asset_adaptation_df.to_csv(os.path.join(adaptation_bcr_results,
+                        f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_adaptation_benefits_costs_bcr_{days}_days_disruption.csv"),
+                        index=False)
 
                 print (f"* Done with {asset_info.asset_gpkg} {asset_info.asset_layer} BCRs for {days} days disruption")
 
@@ -179,15 +181,16 @@ def main(config):
                 non_preferred_options = non_preferred_options.drop_duplicates(subset=[asset_id],keep="first")
                 preferred_options = preferred_options.sort_values(by="max_benefit",ascending=False)
                 preferred_options = preferred_options.drop_duplicates(subset=[asset_id],keep="first")
-                pd.concat([preferred_options,non_preferred_options],axis=0,ignore_index=True).to_csv(
-                        os.path.join(adaptation_bcr_results,
-                        f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_optimal_benefits_costs_bcr_{days}_days_disruption.csv"),
-                        index=False)
-
-                pd.concat([preferred_options,non_preferred_options],axis=0,ignore_index=True).to_parquet(
+                optimal_options = pd.concat([preferred_options,non_preferred_options],axis=0,ignore_index=True)
+                optimal_options.to_parquet(
                         os.path.join(adaptation_bcr_results,
                         f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_optimal_benefits_costs_bcr_{days}_days_disruption.parquet"),
                         index=False)
+                if export_csv is True:
+                    optimal_options.to_csv(
+                            os.path.join(adaptation_bcr_results,
+                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_optimal_benefits_costs_bcr_{days}_days_disruption.csv"),
+                            index=False)
 
 
 if __name__ == '__main__':
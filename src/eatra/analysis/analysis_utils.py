@@ -3,6 +3,7 @@
 import sys
 import os
 import json
+import shutil
 
 import pandas as pd
 import geopandas as gpd
@@ -10,6 +11,9 @@ from scipy.interpolate import interp1d
 from scipy import integrate
 import math
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
 from tqdm import tqdm
 tqdm.pandas()
 
@@ -22,6 +26,50 @@ def load_config():
     return config
 
 
+def write_partitioned_results(dataframe,dataset_path,partition_columns):
+    """Write results to a parquet dataset with one folder for each value of the partition columns
+    
+    Any earlier results in the dataset folder are removed first
+    """
+    if os.path.exists(dataset_path) is True:
+        shutil.rmtree(dataset_path)
+    if len(dataframe.index) > 0:
+        dataframe = dataframe.copy()
+        dataframe[partition_columns] = dataframe[partition_columns].astype(str)
+        pq.write_to_dataset(pa.Table.from_pandas(dataframe,preserve_index=False),
+                            dataset_path,partition_cols=partition_columns)
+
+def read_partitioned_results(dataset_path,partition_columns,filters=None,columns=None):
+    """Read results from a parquet dataset written with write_partitioned_results
+
+    Parameters
+    ----------
+    dataset_path - Path of the dataset folder
+    partition_columns - List of the partition columns, from the top folder down
+    filters - List of (column, operator, value) filters, filters on the partition columns
+                only read the files of the matching folders
+    columns - List of columns to read, all columns if None
+
+    Returns
+    -------
+    Pandas DataFrame of results, with the partition columns as strings
+    """
+    partitioning = ds.partitioning(
+                        pa.schema([(c,pa.string()) for c in partition_columns]),
+                        flavor="hive")
+    return pq.read_table(dataset_path,columns=columns,
+                        filters=filters,partitioning=partitioning).to_pandas()
+
+def export_csv_results(results_path):
+    """Write a CSV copy of each parquet results file in a folder
+
+    The CSV files are only for inspecting and plotting results, the analysis reads the parquet files
+    """
+    for file in sorted(os.listdir(results_path)):
+        if file.endswith(".parquet") is True:
+            pd.read_parquet(os.path.join(results_path,file)).to_csv(
+                    os.path.join(results_path,file.replace(".parquet",".csv")),index=False)
+
 def geopandas_read_file_type(file_path, file_layer, file_database=None):
     if file_database is not None:
         return gpd.read_file(os.path.join(file_path, file_database), layer=file_layer)
@@ -77,6 +125,18 @@ def risks_pivot(dataframe,index_columns,probability_column,
     
     return df[index_columns + [expected_risk_column]]
 
+def expected_risk_column_name(expected_risk_column,
+            flood_protection_period=0,flood_protection_name=None):
+    """Name of the expected risk column for a flood protection standard
+    """
+    if flood_protection_name is None and flood_protection_period == 0:
+        # When there is no flood protection at all
+        return f"{expected_risk_column}_undefended"
+    elif flood_protection_period > 0 and flood_protection_name is None:
+        return f"{expected_risk_column}_{flood_protection_period}_year_protection"
+    
+    return f"{expected_risk_column}_{flood_protection_name}"
+
 def risks(dataframe,index_columns,probabilities,
             expected_risk_column,
             flood_protection_period=0,flood_protection_name=None):
@@ -85,23 +145,12 @@ def risks(dataframe,index_columns,probabilities,
     Organise the dataframe to pivot with respect to index columns
     Find the expected risks
     """
-    if flood_protection_name is None and flood_protection_period == 0:
-        # When there is no flood protection at all
-        expected_risk_column = f"{expected_risk_column}_undefended"
-        probability_columns = [str(p) for p in probabilities]
-        
-    elif flood_protection_period > 0:
-        if flood_protection_name is None:
-            expected_risk_column = f"{expected_risk_column}_{flood_protection_period}_year_protection"
-        else:
-            expected_risk_column = f"{expected_risk_column}_{flood_protection_name}"
-        
+    expected_risk_column = expected_risk_column_name(expected_risk_column,
+                                flood_protection_period=flood_protection_period,
+                                flood_protection_name=flood_protection_name)
+    if flood_protection_period > 0:
         probabilities = [pr for pr in probabilities if pr <= 1.0/flood_protection_period]
-        probability_columns = [str(p) for p in probabilities]
-    else:
-        # When there is no flood protection at all
-        expected_risk_column = f"{expected_risk_column}_{flood_protection_name}"
-        probability_columns = [str(p) for p in probabilities]
+    probability_columns = [str(p) for p in probabilities]
         
     dataframe.columns = dataframe.columns.astype(str)
     dataframe[expected_risk_column] = list(integrate.trapz(dataframe[probability_columns].to_numpy(),
@@ -109,6 +158,42 @@ def risks(dataframe,index_columns,probabilities,
     
     return dataframe[index_columns + [expected_risk_column]]
 
+def risk_integration_weights(scenario_index,probabilities,flood_protection_period=0):
+    """Trapezoidal integration weights of hazard return periods grouped into scenarios
+
+    The expected risks of all scenarios are then the product of the risks
+    with the weights, which is the same as integrating each scenario with integrate.trapz 
+
+    Parameters
+    ----------
+    scenario_index - Numpy array of the integer scenario of each return period,
+                    with the return periods of a scenario next to each other
+    probabilities - Numpy array of the exceedance probability of each return period,
+                    sorted in ascending order within each scenario
+    flood_protection_period - Return period of the flood protection,
+                    probabilities above 1/flood_protection_period are not integrated 
+
+    Returns
+    -------
+    weights - Numpy array of shape (return periods, scenarios) of integration weights
+    """
+    scenario_index = np.asarray(scenario_index)
+    probabilities = np.asarray(probabilities,dtype="float64")
+    weights = np.zeros((len(probabilities),scenario_index.max() + 1 if len(scenario_index) > 0 else 0))
+    keep = np.ones(len(probabilities),dtype=bool)
+    if flood_protection_period > 0:
+        keep = probabilities <= 1.0/flood_protection_period
+    keep_index = np.flatnonzero(keep)
+    # Width of the trapezium between successive probabilities of the same scenario
+    widths = np.where(scenario_index[keep_index[1:]] == scenario_index[keep_index[:-1]],
+                    np.diff(probabilities[keep_index]),0)
+    key_weights = np.zeros(len(keep_index))
+    key_weights[:-1] += 0.5*widths
+    key_weights[1:] += 0.5*widths
+    weights[keep_index,scenario_index[keep_index]] = key_weights
+
+    return weights
+
 def calculate_discounting_arrays(discount_rate=4.5, growth_rate=5.0,
                                 start_year=2020,end_year=2050,
                                 maintain_period=4):
@@ -3,6 +3,8 @@
 """
 import sys
 import os
+import hashlib
+import json
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
 import pandas as pd
@@ -10,34 +12,172 @@ pd.options.mode.chained_assignment = None  # default='warn'
 warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
 import geopandas as gpd
 import numpy as np
+import pyarrow.parquet as pq
 from .analysis_utils import *
 from tqdm import tqdm
 tqdm.pandas()
 
 epsg_project = 3857
+# Exposure columns measured at hazard intersection time and their units
+exposure_measure_columns = {'edges':('exposure_length_m','m'),'areas':('exposure_area_m2','m2')}
+exposure_memory_limit = 2.0e9 # Bytes of exposure rows held in memory before they are aggregated
 
 
-def get_damage_data(x,damage_data_path,
-                    adaptation_num,
-                    uplift_factor=0,
-                    uncertainty_parameter=0):
+def get_damage_curve_file(x,damage_data_path,adaptation_num):
     if adaptation_num == "None":
-        data = pd.read_excel(os.path.join(damage_data_path,
-                        f"damage_curves_{x.sector}_{x.hazard_type}.xlsx"),
-                        sheet_name=x.asset_sheet)
-    else:
-        data = pd.read_excel(os.path.join(damage_data_path,"adaptation_options",
-                        f"damage_curves_{x.sector}_{x.hazard_type}_{adaptation_num}.xlsx"),
-                        sheet_name=x.asset_sheet)
-    if x.hazard_type == 'flooding':
-        x_data = data.flood_depth
+        return os.path.join(damage_data_path,
+                        f"damage_curves_{x.sector}_{x.hazard_type}.xlsx")
     else:
-        x_data = data.wind_speed
+        return os.path.join(damage_data_path,"adaptation_options",
+                        f"damage_curves_{x.sector}_{x.hazard_type}_{adaptation_num}.xlsx")
+
+def read_damage_curve_file(damage_curve_file,hazard_type):
+    """Read the damage curves of all the sheets of a damage curve workbook
+
+    The workbook is compiled once into an NPZ file of the curves of all its sheets,
+    keyed by the hash of the workbook, so later runs skip the Excel parsing.
+    The compiled curves are stored as the sheet names, the start of each curve
+    in the concatenated hazard values, and the minimum and maximum damage ratios.
+
+    Returns
+    -------
+    damage_curves : dict
+        Sheet names mapped to tuples of arrays of hazard values, minimum and maximum damage ratios
+    """
+    with open(damage_curve_file,"rb") as f:
+        file_hash = hashlib.sha1(f.read()).hexdigest()
+    compiled_path = os.path.join(os.path.dirname(damage_curve_file),"compiled")
+    compiled_file = os.path.join(compiled_path,
+                        os.path.basename(damage_curve_file).replace(".xlsx",f"__{file_hash[:16]}.npz"))
+    if os.path.isfile(compiled_file) is False:
+        if hazard_type == 'flooding':
+            x_column = 'flood_depth'
+        else:
+            x_column = 'wind_speed'
+        sheets = [(sheet,data) for sheet,data in pd.read_excel(damage_curve_file,sheet_name=None).items()
+                    if all(c in data.columns for c in [x_column,'damage_ratio_min','damage_ratio_max'])]
+        if len(sheets) == 0:
+            raise ValueError(f"No sheet of {damage_curve_file} has the columns {x_column}, damage_ratio_min and damage_ratio_max")
+        os.makedirs(compiled_path,exist_ok=True)
+        # The curves are written to a temporary file and moved into place, so an interrupted
+        # or concurrent write never leaves a truncated file that later runs would read
+        temporary_file = f"{compiled_file}.{os.getpid()}.tmp"
+        with open(temporary_file,"wb") as f:
+            np.savez(f,
+                    sheets=np.array([sheet for sheet,data in sheets],dtype=str),
+                    offsets=np.cumsum([0] + [len(data.index) for sheet,data in sheets]),
+                    x_data=np.concatenate([data[x_column].values for sheet,data in sheets]).astype("float64"),
+                    y_min_data=np.concatenate([data.damage_ratio_min.values for sheet,data in sheets]).astype("float64"),
+                    y_max_data=np.concatenate([data.damage_ratio_max.values for sheet,data in sheets]).astype("float64"))
+        os.replace(temporary_file,compiled_file)
+
+    with np.load(compiled_file) as compiled:
+        offsets = compiled["offsets"]
+        return dict(
+                    (sheet,tuple(compiled[c][offsets[s]:offsets[s + 1]] for c in ["x_data","y_min_data","y_max_data"]))
+                    for s,sheet in enumerate(compiled["sheets"].tolist())
+                    )
+
+def get_damage_data(x,damage_data_path,
+                    adaptation_num,damage_curve_files=None):
+    """Get the hazard values, minimum and maximum damage ratios of the damage curve of an asset
+
+    damage_curve_files - Optional dictionary of the damage curves read from each file, shared between calls
+    """
+    if damage_curve_files is None:
+        damage_curve_files = {}
+    damage_curve_file = get_damage_curve_file(x,damage_data_path,adaptation_num)
+    if damage_curve_file not in damage_curve_files:
+        damage_curve_files[damage_curve_file] = read_damage_curve_file(damage_curve_file,x.hazard_type)
+
+    return damage_curve_files[damage_curve_file][x.asset_sheet]
+
+def damage_curve_arrays(damage_curves_df):
+    """Concatenate the damage curves of a dataframe into flat arrays
+
+    The breakpoints of each curve are sorted by hazard value
+
+    Returns
+    -------
+    curve_offsets - Start of each curve in the concatenated arrays, with the total length at the end
+    x_data - Hazard values of the curves
+    y_min_data - Minimum damage ratios of the curves
+    y_max_data - Maximum damage ratios of the curves
+    """
+    curves = [np.asarray(c,dtype="float64") for c in damage_curves_df['damage_x_data']]
+    for c in curves:
+        if len(np.unique(c)) < 2:
+            raise ValueError(f"Damage curve with hazard values {c.tolist()} needs at least 2 distinct breakpoints")
+    orders = [np.argsort(c,kind="stable") for c in curves]
+    curve_offsets = np.cumsum([0] + [len(c) for c in curves])
+    x_data = np.concatenate([c[o] for c,o in zip(curves,orders)])
+    y_min_data = np.concatenate([np.asarray(c,dtype="float64")[o] 
+                                    for c,o in zip(damage_curves_df['damage_y_min_data'],orders)])
+    y_max_data = np.concatenate([np.asarray(c,dtype="float64")[o]
+                                    for c,o in zip(damage_curves_df['damage_y_max_data'],orders)])
+    return curve_offsets, x_data, y_min_data, y_max_data
+
+def damage_ratios_for_parameter_sets(hazard_values,curve_ids,
+                    curve_offsets,x_data,y_min_data,y_max_data,
+                    damage_uncertainty_parameters,
+                    uplift_factors=0):
+    """Interpolate the damage ratios of hazard values for several parameter sets,
+    with each row of hazard values evaluated along its own damage curve
+
+    The damage curve of each parameter set lies between the minimum and maximum damage ratios
+    and is uplifted and capped at 1. The curves are placed one after another along a single axis,
+    so the positions of all hazard values along their curves are found with one searchsorted,
+    and are reused for all parameter sets.
+    Values outside a curve take the minimum and maximum damage ratios of the curve.
+
+    Parameters
+    ---------
+    hazard_values - Array of hazard values of each row and hazard
+    curve_ids - Integer index of the damage curve of each row
+    curve_offsets, x_data, y_min_data, y_max_data - Damage curve arrays from damage_curve_arrays
+    damage_uncertainty_parameters - Array of damage uncertainty parameters of the parameter sets
+    uplift_factors - Uplift factor of each curve, or one for all curves
+
+    Returns
+    -------
+    numpy.ndarray
+        Damage ratios with a leading parameter set axis added to the shape of hazard_values
+    """
+    num_curves = len(curve_offsets) - 1
+    curve_lengths = np.diff(curve_offsets)
+    curve_index = np.repeat(np.arange(num_curves),curve_lengths)
+    uplift_factors = np.broadcast_to(np.asarray(uplift_factors,dtype="float64"),(num_curves,))
+    uncertainty = np.asarray(damage_uncertainty_parameters,dtype="float64")[:,np.newaxis]
+    y_data = np.minimum((y_min_data + uncertainty*(y_max_data - y_min_data))*(1 + uplift_factors[curve_index]), 1.0)
+    y_curve_min = np.minimum.reduceat(y_data,curve_offsets[:-1],axis=1)
+    y_curve_max = np.maximum.reduceat(y_data,curve_offsets[:-1],axis=1)
+
+    # Shift each curve to its own stretch of a single sorted axis
+    x_start = x_data[curve_offsets[:-1]]
+    x_end = x_data[curve_offsets[1:] - 1]
+    curve_span = np.max(x_end - x_start) + 1.0
+    x_axis = curve_index*curve_span + (x_data - x_start[curve_index])
 
-    y_data = data.damage_ratio_min + uncertainty_parameter*(data.damage_ratio_max - data.damage_ratio_min)
-    y_data = np.minimum(y_data*(1 + uplift_factor), 1.0)
+    hazard_values = np.asarray(hazard_values,dtype="float64")
+    curve_ids = np.asarray(curve_ids).reshape((-1,) + (1,)*(hazard_values.ndim - 1))
+    curve_ids = np.broadcast_to(curve_ids,hazard_values.shape)
+    values = np.clip(hazard_values,x_start[curve_ids],x_end[curve_ids])
+    index = np.searchsorted(x_axis,curve_ids*curve_span + (values - x_start[curve_ids]),side="right") - 1
+    index = np.clip(index,curve_offsets[curve_ids],curve_offsets[curve_ids + 1] - 2)
+    # Breakpoints with repeated hazard values give stretches of zero width, which take their last damage ratio
+    dx = x_data[index + 1] - x_data[index]
+    weight = np.where(dx > 0,(values - x_data[index])/np.where(dx > 0,dx,1.0),1.0)
+    ratios = y_data[:,index]*(1 - weight) + y_data[:,index + 1]*weight
 
-    return x_data.values, y_data.values
+    ratios = np.where(hazard_values < x_start[curve_ids],y_curve_min[:,curve_ids],ratios)
+    ratios = np.where(hazard_values > x_end[curve_ids],y_curve_max[:,curve_ids],ratios)
+    return ratios
+
+def read_parameter_sets(parameter_combinations_file):
+    """Read the parameter set number, cost and damage uncertainty parameters of each Morris sample"""
+    parameter_sets = pd.read_csv(parameter_combinations_file,header=None,
+                        names=["set_count","cost_uncertainty_parameter","damage_uncertainty_parameter"])
+    return list(parameter_sets.itertuples(index=False,name=None))
 
 def convert_cost_units(x,cost_value,cost_unit,conversion_rate):
     if ("US$" in x[cost_unit]) or ("USD" in x[cost_unit]):
@@ -53,6 +193,10 @@ def modify_cost_units(x,cost_dimension,damage_cost_column='damage_cost'):
     else:
         return x[damage_cost_column]
 
+def aggregate_exposures(dataframe):
+    index_columns = [c for c in dataframe.columns.values.tolist() if c != 'exposure']
+    return dataframe.groupby(index_columns,dropna=False)['exposure'].sum().reset_index()
+
 def add_exposure_dimensions(dataframe,dataframe_type="nodes",epsg=epsg_project):
     geo_dataframe = gpd.GeoDataFrame(dataframe,
                                 geometry = 'geometry',
@@ -68,44 +212,153 @@ def add_exposure_dimensions(dataframe,dataframe_type="nodes",epsg=epsg_project):
         geo_dataframe['exposure_unit'] = 'unit'
     geo_dataframe.drop('geometry',axis=1,inplace=True)
 
-    index_columns = [c for c in geo_dataframe.columns.values.tolist() if c != 'exposure']
-    return geo_dataframe.groupby(index_columns,dropna=False)['exposure'].sum().reset_index()
+    return aggregate_exposures(geo_dataframe)
+
+def read_hazard_exposures(hazard_intersection_file,hazard_thresholds,
+                        dataframe_type="nodes",epsg=epsg_project,
+                        batch_size=100000,memory_limit=exposure_memory_limit):
+    """Read the exposures of assets to hazards from a hazard intersection geoparquet file in batches
+
+    Rows without any hazard value above its threshold are dropped before their geometries are read,
+    so only the exposed rows are reprojected and measured. Geometries are not read at all for nodes,
+    or when the intersection file already has the lengths or areas measured at intersection time.
+    The exposures are aggregated as they are read,
+    whenever the rows held in memory go over the memory limit, which gives the same result as
+    aggregating all of them at the end.
+
+    Parameters
+    ---------
+    hazard_intersection_file - Path of the geoparquet file of asset and hazard intersections
+    hazard_thresholds - Dictionary of hazard value thresholds of each hazard column
+    dataframe_type - Type of the asset geometries: nodes, edges or areas
+    batch_size - Number of rows read at a time
+    memory_limit - Bytes of exposure rows read since the last aggregation held in memory before they are aggregated
+
+    Returns
+    -------
+    Pandas DataFrame of the exposures of the rows with hazard values above their thresholds
+    """
+    parquet_file = pq.ParquetFile(hazard_intersection_file)
+    geo_metadata = json.loads(parquet_file.schema_arrow.metadata[b"geo"])
+    geometry_column = geo_metadata["primary_column"]
+    crs = geo_metadata["columns"][geometry_column].get("crs","OGC:CRS84")
+    column_names = parquet_file.schema_arrow.names
+    hazard_thresholds = dict((k,v) for k,v in hazard_thresholds.items() if k in column_names)
+    measure_column, measure_unit = exposure_measure_columns.get(dataframe_type,(None,'unit'))
+    read_geometry = measure_column is not None and measure_column not in column_names
+    if read_geometry is False:
+        column_names = [c for c in column_names if c != geometry_column]
+
+    exposures = []
+    # Only the rows read since the last aggregation count towards the memory limit,
+    # so the aggregated exposures are not re-aggregated on every later batch
+    pending_size = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size,columns=column_names):
+        exposed = np.zeros(batch.num_rows,dtype=bool)
+        for k,threshold in hazard_thresholds.items():
+            exposed |= batch.column(k).to_numpy(zero_copy_only=False).astype("float64") > threshold
+        if exposed.any():
+            df = batch.filter(exposed).to_pandas()
+            if read_geometry is True:
+                df['geometry'] = gpd.GeoSeries.from_wkb(df.pop(geometry_column).values,crs=crs).values
+                df = gpd.GeoDataFrame(df,geometry='geometry',crs=crs)
+                df = add_exposure_dimensions(df.to_crs(epsg=epsg),dataframe_type=dataframe_type,epsg=epsg)
+            else:
+                if measure_column is not None:
+                    df['exposure'] = df.pop(measure_column)
+                else:
+                    df['exposure'] = 1
+                df['exposure_unit'] = measure_unit
+                df = aggregate_exposures(df)
+            exposures.append(df)
+            pending_size += df.memory_usage(deep=True).sum()
+            if pending_size > memory_limit and len(exposures) > 1:
+                exposures = [aggregate_exposures(pd.concat(exposures,axis=0,ignore_index=True))]
+                pending_size = 0
+
+    if len(exposures) == 0:
+        return pd.DataFrame(columns=[c for c in column_names if c not in (geometry_column,measure_column)] + ['exposure_unit','exposure'])
+    return aggregate_exposures(pd.concat(exposures,axis=0,ignore_index=True))
 
 def create_damage_curves(damage_data_path,
                     damage_curve_lookup_df,
                     adaptation_num,
-                    uplift_factor=0,
-                    uncertainty_parameter=0):
+                    damage_curve_files=None):
     damage_curve_lookup_df['x_y_data'] = damage_curve_lookup_df.progress_apply(
                                                 lambda x:get_damage_data(
                                                     x,damage_data_path,
                                                     adaptation_num,
-                                                    uplift_factor,
-                                                    uncertainty_parameter),
+                                                    damage_curve_files),
                                                 axis=1)
-    damage_curve_lookup_df[['damage_x_data','damage_y_data']] = damage_curve_lookup_df['x_y_data'].apply(pd.Series)
+    damage_curve_lookup_df[['damage_x_data',
+                            'damage_y_min_data',
+                            'damage_y_max_data']] = damage_curve_lookup_df['x_y_data'].apply(pd.Series)
     damage_curve_lookup_df.drop('x_y_data',axis=1,inplace=True)
 
     return damage_curve_lookup_df
 
-def estimate_direct_damage_costs_and_units(dataframe,damage_ratio_columns,
-                        cost_unit_column,damage_cost_column='damage_cost',dataframe_type="nodes"):
+def estimate_direct_damage_costs_and_units(dataframe,damage_ratios,damage_costs,
+                        cost_unit_column,dataframe_type="nodes"):
+    """Multiply the damage ratios of each parameter set by the damage costs and exposures of the assets
+
+    Parameters
+    ---------
+    dataframe - Pandas DataFrame of asset exposures
+    damage_ratios - Array of damage ratios of each parameter set, asset and hazard
+    damage_costs - Array of damage costs of each parameter set and asset
+    cost_unit_column - String name of column of damage cost units
+
+    Returns
+    -------
+    dataframe - Pandas DataFrame of asset exposures with a damage_cost_unit column
+    damages - Array of damage costs of each parameter set, asset and hazard
+    """
     if dataframe_type == "nodes":
-        dataframe[damage_ratio_columns] = dataframe[damage_ratio_columns].multiply(dataframe[damage_cost_column],axis="index")
+        damages = damage_ratios*damage_costs[:,:,np.newaxis]
         dataframe['damage_cost_unit'] = dataframe[cost_unit_column]
     else:
-        dataframe[damage_ratio_columns] = dataframe[damage_ratio_columns].multiply(dataframe[damage_cost_column]*dataframe['exposure'],axis="index")
-        cost_unit = dataframe[cost_unit_column].values.tolist()[0]
-        dataframe['damage_cost_unit'] = "/".join(cost_unit.split('/')[:-1])
+        damages = damage_ratios*(damage_costs*dataframe['exposure'].values)[:,:,np.newaxis]
+        dataframe['damage_cost_unit'] = dataframe[cost_unit_column].str.split('/').str[:-1].str.join('/')
     
-    return dataframe
+    return dataframe, damages
+
+def sum_damages_by_group(dataframe,group_columns,damages):
+    """Sum the damages of each parameter set over the rows of each group of a dataframe
+
+    Returns
+    -------
+    group_df - Pandas DataFrame of the groups, sorted by the group columns
+    group_damages - Array of summed damages of each parameter set, group and hazard
+    """
+    group_ids = dataframe.groupby(group_columns,dropna=False,sort=True).ngroup().values
+    order = np.argsort(group_ids,kind="stable")
+    group_starts = np.flatnonzero(np.r_[True,np.diff(group_ids[order]) != 0])
+    group_df = dataframe[group_columns].iloc[order[group_starts]].reset_index(drop=True)
+    # Missing damages are skipped, as in the pandas groupby sum
+    damages = damages[:,order,:]
+    group_damages = np.add.reduceat(np.where(np.isnan(damages),0.0,damages),group_starts,axis=1)
+    return group_df, group_damages
 
 def main(config,results_folder,
         network_csv,hazard_csv,
         damage_curves_csv,
         adaptation_num,
         hazard_damage_parameters_csv,
-        set_count,cost_uncertainty_parameter,damage_uncertainty_parameter):
+        parameter_sets,
+        memory_limit=exposure_memory_limit):
+    """Estimate the direct damages of all assets for all the parameter sets of the sensitivity analysis
+
+    The exposures and damage curves are read once. Damage ratios are linear in the damage uncertainty
+    parameter and damage costs are linear in the cost uncertainty parameter, so the damages of every
+    parameter set are estimated together along an extra array axis. The results of each parameter set
+    are written to their own files, as before.
+
+    Parameters
+    ---------
+    parameter_sets - List of tuples of (set_count, cost_uncertainty_parameter, damage_uncertainty_parameter)
+    memory_limit - Bytes of hazard exposure rows held in memory while an intersection file is read,
+                    and of the damage arrays of the parameter sets evaluated together
+    """
     incoming_data_path = config['paths']['incoming_data']
     processed_data_path = config['paths']['data']
     results_data_path = config['paths']['results']
@@ -140,19 +393,22 @@ def main(config,results_folder,
     
     hazard_attributes = pd.read_csv(hazard_damage_parameters_csv)
     flood_hazards = hazard_attributes[hazard_attributes["hazard_type"] == "flooding"]["hazard"].values.tolist()
+    cost_uncertainty_parameters = np.array([p[1] for p in parameter_sets],dtype="float64")
+    damage_uncertainty_parameters = np.array([p[2] for p in parameter_sets],dtype="float64")
     
     """Step 1: Get all the damage curves into a dataframe
     """
     damage_curves = []
+    damage_curve_files = {}
     for idx, hazard in hazard_attributes.iterrows():
         damage_curve_df = damage_curve_lookup[damage_curve_lookup['hazard_type'] == hazard['hazard_type']]
         damage_curve_df['hazard'] = hazard['hazard']
+        damage_curve_df['uplift_factor'] = hazard['uplift_factor']
 
         damage_curve_df = create_damage_curves(damage_curve_data_path,
                                                 damage_curve_df,
                                                 adaptation_num,
-                                                uplift_factor=hazard['uplift_factor'],
-                                                uncertainty_parameter=damage_uncertainty_parameter)
+                                                damage_curve_files)
         damage_curves.append(damage_curve_df)
 
     damage_curves = pd.concat(damage_curves,axis=0,ignore_index=True)
@@ -168,22 +424,28 @@ def main(config,results_folder,
         asset_cost_unit = asset_info.asset_cost_unit_column
         
         asset_df = gpd.read_file(os.path.join(processed_data_path,asset_info.path),layer=asset_info.asset_layer)
-        asset_df['damage_cost'] = asset_df[asset_min_cost] + cost_uncertainty_parameter*(
-                                        asset_df[asset_max_cost] - asset_df[asset_min_cost]
-                                                                )
-        asset_df['damage_cost'] = asset_df.progress_apply(lambda x:modify_cost_units(x,asset_cost_unit),axis=1)
-        hazard_damages = []
+        # Costs are linear in the cost uncertainty parameter, so the unit changes are applied to the bounds
+        asset_df['damage_cost_min'] = asset_df.progress_apply(
+                                        lambda x:modify_cost_units(x,asset_cost_unit,asset_min_cost),axis=1)
+        asset_df['damage_cost_max'] = asset_df.progress_apply(
+                                        lambda x:modify_cost_units(x,asset_cost_unit,asset_max_cost),axis=1)
+        hazard_damages = [[] for p in parameter_sets]
 
         for hazard_file in hazard_data_files:
             hazard_intersection_file = os.path.join(hazard_asset_intersection_path,
                                         f"{asset_info.asset_gpkg}_splits__{hazard_file.replace('__with_transforms.csv','')}__{asset_info.asset_layer}.geoparquet")
             hazard_data_details = pd.read_csv(os.path.join(hazard_data_path,hazard_file),encoding="latin1")
             if os.path.isfile(hazard_intersection_file) is True: 
-                hazard_df = gpd.read_parquet(hazard_intersection_file)
-                hazard_df = hazard_df.to_crs(epsg=epsg_project)
-                hazard_df = add_exposure_dimensions(hazard_df,
+                # Only read the exposures with hazard values above the thresholds of the hazards of the asset
+                hazard_thresholds = {}
+                for hazard_info in hazard_attributes.itertuples():
+                    if getattr(asset_info,f"{hazard_info.hazard}_asset_damage_lookup_column") != 'none':
+                        hazard_keys = hazard_data_details[hazard_data_details["hazard"] == hazard_info.hazard]["key"].values.tolist()
+                        hazard_thresholds.update([(k,hazard_info.hazard_threshold) for k in hazard_keys])
+                hazard_df = read_hazard_exposures(hazard_intersection_file,hazard_thresholds,
                                                     dataframe_type=asset_info.asset_layer,
-                                                    epsg=epsg_project)
+                                                    epsg=epsg_project,
+                                                    memory_limit=memory_limit)
                 for hazard_info in hazard_attributes.itertuples():
                     if getattr(asset_info,f"{hazard_info.hazard}_asset_damage_lookup_column") != 'none':
                         asset_hazard = getattr(asset_info,f"{hazard_info.hazard}_asset_damage_lookup_column")
@@ -199,7 +461,7 @@ def main(config,results_folder,
                         damaged_assets = list(set(damages_df['asset_name'].values.tolist()))
                         affected_assets_df = asset_df[
                                                     asset_df[asset_hazard].isin(damaged_assets)
-                                                    ][[asset_id,asset_hazard,asset_cost_unit,'damage_cost']]
+                                                    ][[asset_id,asset_hazard,asset_cost_unit,'damage_cost_min','damage_cost_max']]
                         damaged_assets = list(set(affected_assets_df[asset_hazard].values.tolist()))
                         damages_df = damages_df[damages_df['asset_name'].isin(damaged_assets)]
                         affected_assets = list(set(affected_assets_df[asset_id].values.tolist()))
@@ -219,44 +481,62 @@ def main(config,results_folder,
                         else: 
                             hazard_effect_df = pd.merge(hazard_effect_df,affected_assets_df,how='left',on=[asset_id])
                             # print (hazard_info.key)
-                            for damage_info in damages_df.itertuples():
-                                hazard_asset_effect_df = hazard_effect_df[hazard_effect_df[asset_hazard] == damage_info.asset_name]
-                                if len(hazard_asset_effect_df.index) > 0:
-                                    hazard_asset_effect_df[hazard_keys] = interp1d(damage_info.damage_x_data,damage_info.damage_y_data,
-                                                fill_value=(min(damage_info.damage_y_data),max(damage_info.damage_y_data)),
-                                                bounds_error=False)(hazard_asset_effect_df[hazard_keys])
-                                    hazard_asset_effect_df = estimate_direct_damage_costs_and_units(hazard_asset_effect_df,
-                                                                hazard_keys,asset_cost_unit,dataframe_type=asset_info.asset_layer)
-                                    
-                                    sum_dict = dict([(hk,"sum") for hk in hazard_keys])
-                                    hazard_asset_effect_df = hazard_asset_effect_df.groupby([asset_id,
-                                                            'exposure_unit',
-                                                            'damage_cost_unit',
-                                                            'exposure'
-                                                            ],
-                                                            dropna=False).agg(sum_dict).reset_index()
-
-                                    hazard_asset_effect_df['damage_uncertainty_parameter'] = damage_uncertainty_parameter
-                                    hazard_asset_effect_df['cost_uncertainty_parameter'] = cost_uncertainty_parameter
-                                    hazard_damages.append(hazard_asset_effect_df)
-
-                                del hazard_asset_effect_df
+                            # Evaluate the damage curves of all the asset types in one pass
+                            damages_df = damages_df.drop_duplicates(subset=['asset_name'])
+                            curve_offsets, x_data, y_min_data, y_max_data = damage_curve_arrays(damages_df)
+                            curve_ids = pd.Index(damages_df['asset_name'].values).get_indexer(
+                                                hazard_effect_df[asset_hazard].values)
+                            # The damage ratios and damages of a parameter set take about 4 float64 arrays
+                            # of the rows and hazards, so the parameter sets are evaluated in chunks within the memory limit
+                            set_size = 32*len(hazard_effect_df.index)*len(hazard_keys)
+                            chunk_size = max(1,int(memory_limit//max(set_size,1)))
+                            for p_start in range(0,len(parameter_sets),chunk_size):
+                                p_chunk = slice(p_start,p_start + chunk_size)
+                                damage_ratios = damage_ratios_for_parameter_sets(
+                                            hazard_effect_df[hazard_keys].values,
+                                            curve_ids,
+                                            curve_offsets, x_data, y_min_data, y_max_data,
+                                            damage_uncertainty_parameters[p_chunk],
+                                            uplift_factors=damages_df['uplift_factor'].values)
+                                damage_costs = hazard_effect_df['damage_cost_min'].values + np.outer(
+                                            cost_uncertainty_parameters[p_chunk],
+                                            hazard_effect_df['damage_cost_max'].values - hazard_effect_df['damage_cost_min'].values)
+                                hazard_effect_df, damages = estimate_direct_damage_costs_and_units(hazard_effect_df,
+                                                            damage_ratios,damage_costs,
+                                                            asset_cost_unit,dataframe_type=asset_info.asset_layer)
+                                del damage_ratios, damage_costs
+                                
+                                group_df, group_damages = sum_damages_by_group(hazard_effect_df,
+                                                        [asset_id,
+                                                        'exposure_unit',
+                                                        'damage_cost_unit',
+                                                        'exposure'
+                                                        ],
+                                                        damages)
+                                del damages
+                                for p, (set_count,cost_uncertainty_parameter,damage_uncertainty_parameter) in enumerate(
+                                                                                    parameter_sets[p_chunk],start=p_start):
+                                    set_damages_df = group_df.copy()
+                                    set_damages_df[hazard_keys] = group_damages[p - p_start]
+                                    set_damages_df['damage_uncertainty_parameter'] = damage_uncertainty_parameter
+                                    set_damages_df['cost_uncertainty_parameter'] = cost_uncertainty_parameter
+                                    hazard_damages[p].append(set_damages_df)
+
+                                del group_df, group_damages
                             del hazard_effect_df
                     else:
                         print (f"* {asset_info.asset_gpkg} {asset_info.asset_layer} not affected by {hazard_info.hazard}")
-        if len(hazard_damages) > 0:
+        if len(hazard_damages[0]) > 0:
             asset_damages_results = os.path.join(direct_damages_results,f"{asset_info.asset_gpkg}_{asset_info.asset_layer}")
             if os.path.exists(asset_damages_results) == False:
                 os.mkdir(asset_damages_results)
-            hazard_damages = pd.concat(hazard_damages,axis=0,ignore_index=True).fillna(0)
-            hazard_damages.to_parquet(os.path.join(
-                        asset_damages_results,
-                        f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_direct_damages_parameter_set_{set_count}.parquet"),
-                        index=False)
-            hazard_damages.to_csv(os.path.join(
-                        asset_damages_results,
-                        f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_direct_damages_parameter_set_{set_count}.csv"),
-                        index=False)
+            for p, (set_count,cost_uncertainty_parameter,damage_uncertainty_parameter) in enumerate(parameter_sets):
+                set_damages = pd.concat(hazard_damages[p],axis=0,ignore_index=True).fillna(0)
+                set_damages.to_parquet(os.path.join(
+                            asset_damages_results,
+                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_direct_damages_parameter_set_{set_count}.parquet"),
+                            index=False)
+                del set_damages
         else: 
             print("Problem.")
 
@@ -269,9 +549,12 @@ if __name__ == "__main__":
         damage_curves_csv = str(sys.argv[4])
         adaptation_num = str(sys.argv[5])
         hazard_damage_parameters_csv = str(sys.argv[6])
-        set_count = str(sys.argv[7])
-        cost_uncertainty_parameter = float(sys.argv[8])
-        damage_uncertainty_parameter = float(sys.argv[9])
+        if len(sys.argv) > 8:
+            # A single parameter set given as set_count cost_uncertainty_parameter damage_uncertainty_parameter
+            parameter_sets = [(str(sys.argv[7]),float(sys.argv[8]),float(sys.argv[9]))]
+        else:
+            # All the parameter sets in a parameter combinations file
+            parameter_sets = read_parameter_sets(str(sys.argv[7]))
 
     except IndexError:
         print("Got arguments", sys.argv)
@@ -282,4 +565,4 @@ if __name__ == "__main__":
         damage_curves_csv,
         adaptation_num,
         hazard_damage_parameters_csv,
-        set_count,cost_uncertainty_parameter,damage_uncertainty_parameter)
\ No newline at end of file
+        parameter_sets)
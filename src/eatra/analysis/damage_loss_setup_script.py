@@ -79,6 +79,7 @@ def main(config):
     generate_EAD_EAEL = True
     generate_summary_results = True
     generate_timeseries = True
+    generate_csv_exports = True
     for option in adaptation_options:
         folder_name = option['folder_name']
         results_folder = os.path.join(results_path,folder_name)
@@ -128,27 +129,19 @@ def main(config):
         
         num_blocks = len(param_values)
 
-        with open("damage_results.txt","w+") as f:
-            with open(parameter_combinations_file,"r") as r:
-                for p in r:
-                    pv = p.split(",")
-                    f.write(f"{damage_results_folder},{network_csv},{hazard_csv},{damage_curves_csv},{option['num']},{hazard_damage_parameters_csv},{pv[0]},{pv[1]},{pv[2]}")
-        
-        f.close()
-
-        
-
-        """Next we call the failure analysis script and loop through the failure scenarios
+        """Next we call the damage calculation script, which runs all the parameter sets in one pass
         """
         if generate_direct_damages is True:
-            args = ["parallel",
-                    "-j", str(num_blocks),
-                    "--colsep", ",",
-                    "-a",
-                    "damage_results.txt",
+            args = [
                     "python",
                     "damage_calculations.py",
-                    "{}"
+                    f"{damage_results_folder}",
+                    f"{network_csv}",
+                    f"{hazard_csv}",
+                    f"{damage_curves_csv}",
+                    f"{option['num']}",
+                    f"{hazard_damage_parameters_csv}",
+                    f"{parameter_combinations_file}"
                     ]
             print ("* Start the processing of damage calculations")
             print (args)
@@ -212,6 +205,14 @@ def main(config):
             print (args)
             subprocess.run(args)
 
+        """Finally we write CSV copies of the summary and NPV results, which are only needed for inspection and plots
+        """
+        if generate_csv_exports is True:
+            for csv_folder in [summary_folder,discounted_results_folder]:
+                if os.path.exists(os.path.join(results_path,csv_folder)) is True:
+                    export_csv_results(os.path.join(results_path,csv_folder))
+            print ("* Done with the CSV exports of summary and NPV results")
+
                                 
 if __name__ == '__main__':
     CONFIG = load_config()
@@ -11,11 +11,54 @@ from .analysis_utils import *
 from tqdm import tqdm
 tqdm.pandas()
 
-def quantiles(dataframe,grouping_by_columns,grouped_columns):
-    grouped = dataframe.groupby(grouping_by_columns,dropna=False)[grouped_columns].agg([np.min, np.mean, np.max]).reset_index()
-    grouped.columns = grouping_by_columns + [f"{prefix}_{agg_name}" for prefix, agg_name in grouped.columns if prefix not in grouping_by_columns]
+def update_quantiles(quantile_values,dataframe,grouping_by_columns,grouped_columns):
+    """Fold the values of a dataframe into the running min, sum, max and count of each group
+
+    Only the running values are kept, so results of many parameter sets
+    can be summarised one file at a time 
+
+    Parameters
+    ----------
+    quantile_values - Dictionary of running values from an earlier call, or None for the first dataframe
+    dataframe - Pandas DataFrame of values to add
+    grouping_by_columns - List of columns to group the values by
+    grouped_columns - List of columns of values
+
+    Returns
+    -------
+    quantile_values - Dictionary of Pandas DataFrames of the running amin, sum, amax and count values
+                        indexed by the grouping columns
+    """
+    grouped = dataframe.groupby(grouping_by_columns,dropna=False)[grouped_columns]
+    values = {"amin":grouped.min(),"sum":grouped.sum(),"amax":grouped.max(),"count":grouped.count()}
+    if quantile_values is None:
+        return values
+
+    levels = list(range(len(grouping_by_columns)))
+    for agg_name in ["amin","sum","amax","count"]:
+        grouped = pd.concat([quantile_values[agg_name],values[agg_name]],axis=0).groupby(level=levels,dropna=False)
+        if agg_name == "amin":
+            quantile_values[agg_name] = grouped.min()
+        elif agg_name == "amax":
+            quantile_values[agg_name] = grouped.max()
+        else:
+            quantile_values[agg_name] = grouped.sum()
+
+    return quantile_values
+
+def quantiles_from_values(quantile_values,grouping_by_columns,grouped_columns):
+    """Min, mean and max of each group from the running values of update_quantiles
+
+    The columns are named as in quantiles
+    """
+    summary = {"amin":quantile_values["amin"],
+                "mean":quantile_values["sum"]/quantile_values["count"],
+                "amax":quantile_values["amax"]}
+    grouped = pd.concat(dict([(f"{c}_{agg_name}",summary[agg_name][c]) for c in grouped_columns for agg_name in ["amin","mean","amax"]]),
+                        axis=1)
+    grouped.index.names = grouping_by_columns
     
-    return grouped
+    return grouped.reset_index()
 
 def main(config,direct_damages_folder,
         summary_results_folder,
@@ -43,6 +86,7 @@ def main(config,direct_damages_folder,
         asset_damages_results = os.path.join(direct_damages_results,f"{asset_info.asset_gpkg}_{asset_info.asset_layer}")
 
         # Process the exposure and damage results
+        # Each parameter set file is read on its own and folded into the running min, mean and max values
         damage_files = [os.path.join(
                                 asset_damages_results,
                                 f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_direct_damages_parameter_set_{param.parameter_set}.parquet"
@@ -51,12 +95,11 @@ def main(config,direct_damages_folder,
                                 asset_damages_results,
                                 f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_economic_losses_parameter_set_{param.parameter_set}.parquet"
                                 ) for param in param_values.itertuples()]
-        damage_results = [pd.read_parquet(file) for file in damage_files if os.path.isfile(file) is True]
-        loss_results = [pd.read_parquet(file) for file in loss_files if os.path.isfile(file) is True]
-        # print ("* Done with creating list of all dataframes")
+        damage_files = [file for file in damage_files if os.path.isfile(file) is True]
+        loss_files = [file for file in loss_files if os.path.isfile(file) is True]
 
-        if damage_results:
-            exposures = damage_results[0].copy()
+        if damage_files:
+            exposures = pd.read_parquet(damage_files[0])
             hazard_columns = [c for c in exposures.columns.values.tolist() if c not in [asset_id,
                                                                                     'exposure_unit',
                                                                                     'damage_cost_unit',
@@ -72,73 +115,60 @@ def main(config,direct_damages_folder,
                                         dropna=False).agg(sum_dict).reset_index()
             exposures.to_parquet(os.path.join(summary_results,
                             f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_exposures.parquet"),index=False)
-            exposures.to_csv(os.path.join(summary_results,
-                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_exposures.csv"),index=False)
             del exposures
             
-            damages = []
-            for df in damage_results:
+            damages = None
+            for file in damage_files:
+                df = pd.read_parquet(file,columns=[asset_id,'damage_cost_unit'] + hazard_columns)
                 df = df.groupby([asset_id,
                                 'damage_cost_unit',
                                 ],
                                 dropna=False).agg(sum_dict).reset_index()
-                damages.append(df)
+                damages = update_quantiles(damages,df,[asset_id,'damage_cost_unit'],hazard_columns)
+                del df
 
-            damages = pd.concat(damages,axis=0,ignore_index=True)
-            print ("* Done with concatinating all dataframes")
-            if len(damages.index) > 0:
-                damages = quantiles(damages,[asset_id,'damage_cost_unit'],hazard_columns)
+            if len(damages["count"].index) > 0:
+                damages = quantiles_from_values(damages,[asset_id,'damage_cost_unit'],hazard_columns)
                 damages.to_parquet(os.path.join(summary_results,
                             f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_damages.parquet"),index=False)
-                damages.to_csv(os.path.join(summary_results,
-                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_damages.csv"),index=False)
             del damages
 
-            if len(loss_results) > 0:
-                losses = pd.concat(loss_results,axis=0,ignore_index=True)
-                print ("* Done with concatinating all dataframes")
-                if len(losses.index) > 0:
-                    losses = quantiles(losses,[asset_id,'economic_loss_unit'],hazard_columns)
-                    losses.to_parquet(os.path.join(summary_results,
-                                f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_losses.parquet"),index=False)
-                    losses.to_csv(os.path.join(summary_results,
-                                f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_losses.csv"),index=False)
+            losses = None
+            for file in loss_files:
+                df = pd.read_parquet(file)
+                loss_columns = [c for c in hazard_columns if c in df.columns.values.tolist()]
+                losses = update_quantiles(losses,df,[asset_id,'economic_loss_unit'],loss_columns)
+                del df
+
+            if losses is not None and len(losses["count"].index) > 0:
+                losses = quantiles_from_values(losses,[asset_id,'economic_loss_unit'],loss_columns)
+                losses.to_parquet(os.path.join(summary_results,
+                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_losses.parquet"),index=False)
             del losses
         # Process the EAD and EAEL results 
-        damage_files = [os.path.join(
+        damage_dataset = os.path.join(
                                 asset_damages_results,
-                                f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL_parameter_set_{param.parameter_set}.csv"
-                                ) for param in param_values.itertuples()]
-        damage_results = [pd.read_csv(file, dtype={'rcp': 'str', 'epoch': 'str'}) for file in damage_files if os.path.isfile(file) is True]
-
-        if damage_results:
-            # print ([len(df.index) for df in damage_results])
-            for df in damage_results:
-                df["rcp"] = df["rcp"].astype(str)
-                df["epoch"] = df["epoch"].astype(str)
-            haz_rcp_epochs = list(set(damage_results[0].set_index(["hazard","rcp","epoch"]).index.values.tolist()))
-            # print (haz_rcp_epochs)
-            summarised_damages = []
-            for i,(haz,rcp,epoch) in enumerate(haz_rcp_epochs):
-                damages = [df[(df.hazard == haz) & (df.rcp == rcp) & (df.epoch == epoch)] for df in damage_results]
-                damages = pd.concat(damages,axis=0,ignore_index=True)
-                # print ("* Done with concatinating all dataframes")
-                damages.drop(["confidence","subsidence","model"],axis=1,inplace=True)
-            
-                index_columns = [c for c in damages.columns.values.tolist() if ("EAD_" not in c) and ("EAEL_" not in c)]
-                index_columns = [i for i in index_columns if i not in uncertainty_columns]
-                damage_columns = [c for c in damages.columns.values.tolist() if ("EAD_" in c) or ("EAEL_" in c)]
-            
+                                f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL")
+        if os.path.isdir(damage_dataset) is True:
+            partition_columns = ["parameter_set","hazard","rcp","epoch"]
+            summarised_damages = None
+            for param in param_values.itertuples():
+                # Only the files of the parameter set folder are read
+                damages = read_partitioned_results(damage_dataset,partition_columns,
+                                                    filters=[("parameter_set","==",param.parameter_set)])
                 if len(damages.index) > 0:
-                    summarised_damages.append(quantiles(damages,index_columns,damage_columns))
-            summarised_damages = pd.concat(summarised_damages,axis=0,ignore_index=True)
-            
-            summarised_damages.to_parquet(os.path.join(summary_results,
-                        f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL.parquet"),index=False)
-            summarised_damages.to_csv(os.path.join(summary_results,
-                        f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL.csv"),index=False)
+                    damages.drop(["parameter_set","confidence","subsidence","model"],axis=1,inplace=True)
+                    index_columns = [c for c in damages.columns.values.tolist() if ("EAD_" not in c) and ("EAEL_" not in c)]
+                    index_columns = [i for i in index_columns if i not in uncertainty_columns]
+                    damage_columns = [c for c in damages.columns.values.tolist() if ("EAD_" in c) or ("EAEL_" in c)]
+                    summarised_damages = update_quantiles(summarised_damages,damages,index_columns,damage_columns)
+                del damages
+
+            if summarised_damages is not None:
+                summarised_damages = quantiles_from_values(summarised_damages,index_columns,damage_columns)
+                summarised_damages.to_parquet(os.path.join(summary_results,
+                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL.parquet"),index=False)
             
-            # print (len(summarised_damages.index))
             del summarised_damages
         print (f"* Done with {asset_info.asset_gpkg} {asset_info.asset_layer}")
 
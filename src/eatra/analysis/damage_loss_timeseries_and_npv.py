@@ -18,12 +18,56 @@ from .analysis_utils import *
 from tqdm import tqdm
 tqdm.pandas()
 
+def interpolation_weights(epochs,years):
+    """Linear interpolation weights of values at the epochs for each year
+
+    Years before the first or after the last epoch are extrapolated from the first or last two epochs,
+    as interp1d with fill_value="extrapolate" does
+
+    Returns
+    -------
+    weights - Numpy array of shape (epochs, years), values at the epochs multiplied by it give the values in the years
+    """
+    epochs = np.asarray(epochs,dtype="float64")
+    years = np.asarray(years,dtype="float64")
+    weights = np.zeros((len(epochs),len(years)))
+    if len(epochs) == 1:
+        weights[0] = 1
+        return weights
+
+    year_index = np.arange(len(years))
+    segment = np.clip(np.searchsorted(epochs,years,side="right") - 1,0,len(epochs) - 2)
+    fraction = (years - epochs[segment])/(epochs[segment + 1] - epochs[segment])
+    weights[segment,year_index] = 1.0 - fraction
+    weights[segment + 1,year_index] = fraction
+
+    return weights
+
 def estimate_time_series(summarised_damages,
-						asset_id,index_columns,
-						risk_type,val_type,
-                        baseline_year,projection_end_year,
-                        growth_rates,discounting_rate,discounted_values,timeseries_results):
-    summarised_damages.epoch= summarised_damages.epoch.astype(int)
+                        asset_id,index_columns,value_columns,
+                        baseline_year,projection_end_year,discounting_rate):
+    """Estimate the yearly values and NPVs of all assets, hazard scenarios and value columns together
+
+    Each projected (hazard, rcp) scenario is combined with the baseline values of its hazard,
+    the values at the epochs are interpolated to years with one weight matrix
+    and discounted with one vector of discount factors
+
+    Parameters
+    ----------
+    summarised_damages - Pandas DataFrame of values of assets for each hazard, rcp and epoch
+    asset_id - String name of the asset ID column
+    index_columns - List of columns identifying the rows of values, without the rcp and epoch columns
+    value_columns - List of columns of values to estimate timeseries for
+
+    Returns
+    -------
+    time_series - Pandas DataFrame of index_columns and rcp of the rows of the timeseries
+    yearly_values - Numpy array of shape (rows, value columns, years) of yearly values
+    timeseries - Numpy array of the years
+    discounted_values - Numpy array of shape (rows, value columns) of NPVs
+    """
+    summarised_damages = summarised_damages.copy()
+    summarised_damages["epoch"] = summarised_damages["epoch"].astype(str).replace("hist",str(baseline_year)).astype(int)
     years = sorted(list(set(summarised_damages.epoch.values.tolist())))
     
     start_year = years[0]
@@ -38,48 +82,43 @@ def estimate_time_series(summarised_damages,
     dsc_rate = calculate_discounting_rate_factor(discount_rate=discounting_rate,
                                     start_year=start_year,end_year=end_year,maintain_period=1)
     timeseries = np.arange(start_year,end_year+1,1)
-    hazard_rcp = list(set(zip(summarised_damages.hazard.values.tolist(),summarised_damages.rcp.values.tolist())))
-    hazard_rcp = [hz_rcp for hz_rcp in hazard_rcp if hz_rcp[1] != "baseline"]
-    
-    defence_column = [c for c in summarised_damages.columns.values.tolist() if f"{risk_type}_" in c and f"_{val_type}" in c][0]
-    damages_time_series = []
-    for ix, (haz,rcp) in enumerate(hazard_rcp):
-        haz_rcp_damages = summarised_damages[(
-                                summarised_damages["hazard"] == haz
-                                ) & (
-                                summarised_damages["rcp"].isin(["baseline",rcp])
-                                )]
-        haz_rcp_damages.drop(haz_rcp_damages[(haz_rcp_damages['rcp'] == 'baseline') & (haz_rcp_damages['epoch'].isin([2030,2050,2080]))].index, inplace = True)
-        years = sorted(list(set(haz_rcp_damages.epoch.values.tolist())))
-
-        df = (haz_rcp_damages.set_index(index_columns).pivot(
-                            columns="epoch"
-                            )[defence_column].reset_index().rename_axis(None, axis=1)).fillna(0)
-        df["rcp"] = rcp
-        series = np.array([list(timeseries)*len(df.index)]).reshape(len(df.index),len(timeseries))
-        df[series[0]] = interp1d(years,df[years],fill_value="extrapolate",bounds_error=False)(series[0])
-        df[series[0]] = df[series[0]].clip(lower=0.0)
-        # if risk_type == "EAEL":
-        #     gr_rates = extract_growth_rate_info(growth_rates,"year",f"gdp_{val_type}",start_year=start_year,end_year=end_year)
-        #     gr_rates = calculate_growth_rate_factor(gr_rates,start_year,end_year)
-        #     df[series[0]] = np.multiply(df[series[0]],gr_rates)
-        damages_time_series.append(df)
-        df_copy = df.copy()
-        df_copy[series[0]] = np.multiply(df_copy[series[0]],dsc_rate)
-        df_copy[f"{haz}__rcp_{rcp}__{risk_type}_{val_type}"] = df_copy[series[0]].sum(axis=1)
-        discounted_values.append(df_copy[[asset_id,f"{haz}__rcp_{rcp}__{risk_type}_{val_type}"]])
-        del df, df_copy
-
-    damages_time_series = pd.concat(damages_time_series,axis=0,ignore_index=False)
-    index_columns = [c for c in damages_time_series.columns.values.tolist() if c not in timeseries]
-
-    return damages_time_series[index_columns + list(timeseries)],discounted_values
+
+    # Add the baseline values of each hazard to each of its projected rcp scenarios
+    projections = summarised_damages[summarised_damages["rcp"] != "baseline"]
+    scenarios = projections[["hazard","rcp"]].drop_duplicates()
+    baseline = summarised_damages[(
+                            summarised_damages["rcp"] == "baseline"
+                            ) & (
+                            ~summarised_damages["epoch"].isin([2030,2050,2080])
+                            )]
+    baseline = pd.merge(baseline.drop("rcp",axis=1),scenarios,how="inner",on=["hazard"])
+    summarised_damages = pd.concat([baseline,projections],axis=0,ignore_index=True)
+    del baseline, projections
+
+    values = summarised_damages.set_index(index_columns + ["rcp","epoch"])[value_columns].unstack("epoch")
+    time_series = values.index.to_frame(index=False)
+    scenario_epochs = summarised_damages.groupby(["hazard","rcp"])["epoch"].unique()
+    scenario_epochs = pd.Series([tuple(sorted(e)) for e in scenario_epochs.values],
+                            index=scenario_epochs.index).reindex(
+                                pd.MultiIndex.from_frame(time_series[["hazard","rcp"]])).values
+
+    yearly_values = np.zeros((len(time_series.index),len(value_columns),len(timeseries)))
+    for epochs in set(scenario_epochs):
+        # Rows of the scenarios with the same epochs are interpolated together
+        rows = np.flatnonzero(np.array([e == epochs for e in scenario_epochs],dtype=bool))
+        epoch_values = np.stack([values[c][list(epochs)].to_numpy()[rows] for c in value_columns],axis=1)
+        yearly_values[rows] = np.nan_to_num(epoch_values,nan=0.0) @ interpolation_weights(epochs,timeseries)
+    yearly_values = np.clip(yearly_values,0.0,None)
+    discounted_values = yearly_values @ dsc_rate
+
+    return time_series, yearly_values, timeseries, discounted_values
 
 def main(config,summary_results_folder,
         timeseries_results_folder,
         discounted_results_folder,
         network_csv,
-        baseline_year=2020,projection_end_year=2100,discounting_rate=10):
+        baseline_year=2020,projection_end_year=2100,discounting_rate=10,
+        write_timeseries=True):
     incoming_data_path = config['paths']['incoming_data']
     processed_data_path = config['paths']['data']
     results_data_path = config['paths']['results']
@@ -95,63 +134,56 @@ def main(config,summary_results_folder,
         os.mkdir(discounted_results)
     
     asset_data_details = pd.read_csv(network_csv)
-    
-    growth_rates = pd.read_excel(os.path.join(processed_data_path,'macroeconomic_data',
-                                'gdp_growth_rates.xlsx'),
-                                sheet_name='Sheet1').fillna(0)
 
     for asset_info in asset_data_details.itertuples():
         asset_id = asset_info.asset_id_column
-        index_columns = [asset_id,"damage_cost_unit","hazard"]
         file = os.path.join(summary_results,
-                        f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL.csv")
+                        f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL.parquet")
         if os.path.isfile(file) is True:
-            summarised_damages = pd.read_csv(file)
-            summarised_damages.loc[summarised_damages["epoch"] == "hist","epoch"] = baseline_year
-
-            discounted_values = []
-            for risk_type in ["EAD","EAEL"]: # "EAD","EAEL"
-                for val_type in ["amin","mean","amax"]:
-                    if risk_type == "EAEL": 
-                        eael_exists = [c for c in summarised_damages.columns.values.tolist() if "EAEL_" in c]
-                        if len(eael_exists) > 0:
-                            index_columns = [asset_id,"economic_loss_unit","hazard"]
-
-                            damages_time_series,discounted_values = estimate_time_series(summarised_damages,
-                            										asset_id,
+            summarised_damages = pd.read_parquet(file)
+            risk_types = ["EAD"]
+            if len([c for c in summarised_damages.columns.values.tolist() if "EAEL_" in c]) > 0:
+                risk_types += ["EAEL"]
+            # All the risk types and values are estimated together
+            risk_values = [(risk_type,val_type,
+                            [c for c in summarised_damages.columns.values.tolist() if f"{risk_type}_" in c and f"_{val_type}" in c][0]
+                            ) for risk_type in risk_types for val_type in ["amin","mean","amax"]]
+            index_columns = [c for c in [asset_id,"damage_cost_unit","economic_loss_unit"] if c in summarised_damages.columns.values.tolist()] + ["hazard"]
+            time_series, yearly_values, timeseries, discounted_values = estimate_time_series(summarised_damages,
+                                                                    asset_id,
                                                                     index_columns,
-                                                                    risk_type,
-                                                                    val_type,
+                                                                    [c for r,v,c in risk_values],
                                                                     baseline_year,
                                                                     projection_end_year,
-                                                                    growth_rates,
-                                                                    discounting_rate,
-                                                                    discounted_values,
-                                                                    timeseries_results)
+                                                                    discounting_rate)
+            scenario_names = time_series["hazard"].astype(str) + "__rcp_" + time_series["rcp"].astype(str)
+            npvs = []
+            for v,(risk_type,val_type,value_column) in enumerate(risk_values):
+                if write_timeseries is True:
+                    if risk_type == "EAEL":
+                        timeseries_index = [asset_id,"economic_loss_unit","hazard","rcp"]
                     else:
-                        damages_time_series,discounted_values = estimate_time_series(summarised_damages,
-                        											asset_id,
-                                                                    index_columns,
-                                                                    risk_type,
-                                                                    val_type,
-                                                                    baseline_year,
-                                                                    projection_end_year,
-                                                                    growth_rates,
-                                                                    discounting_rate,
-                                                                    discounted_values,
-                                                                    timeseries_results)
-
+                        timeseries_index = [asset_id,"damage_cost_unit","hazard","rcp"]
+                    damages_time_series = pd.concat([time_series[timeseries_index],
+                                            pd.DataFrame(yearly_values[:,v,:],columns=list(timeseries))],axis=1)
                     damages_time_series.to_csv(os.path.join(timeseries_results,
                                 f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_{risk_type}_timeseries_{val_type}.csv"),index=False)
                     print (f"* Done with {asset_info.asset_gpkg} {asset_info.asset_layer} {risk_type} timeseries {val_type}")
-
-            dfs = [df.set_index(asset_id) for df in discounted_values]
-            discounted_values = pd.concat(dfs,axis=1).fillna(0)
+                
+                npvs.append(pd.DataFrame({asset_id:time_series[asset_id].values,
+                                "scenario":(scenario_names + f"__{risk_type}_{val_type}").values,
+                                "npv":discounted_values[:,v]}))
+
+            discounted_values = pd.concat(npvs,axis=0,ignore_index=True)
+            npv_columns = discounted_values["scenario"].drop_duplicates().values.tolist()
+            discounted_values = discounted_values.groupby([asset_id,"scenario"])["npv"].sum().unstack("scenario")
+            discounted_values = discounted_values[npv_columns].rename_axis(None,axis=1).fillna(0)
             discounted_values = discounted_values.reset_index()
             discounted_values["damage_cost_unit"] = summarised_damages["damage_cost_unit"].values[0]
-            discounted_values["economic_loss_unit"] = summarised_damages["economic_loss_unit"].values[0]
-            discounted_values.to_csv(os.path.join(discounted_results,
-                                f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL_npvs.csv"),index=False)
+            if "EAEL" in risk_types:
+                discounted_values["economic_loss_unit"] = summarised_damages["economic_loss_unit"].values[0]
+            discounted_values.to_parquet(os.path.join(discounted_results,
+                                f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL_npvs.parquet"),index=False)
 
             print (f"* Done with {asset_info.asset_gpkg} discounted values")
 
@@ -169,10 +201,12 @@ if __name__ == "__main__":
     baseline_year = 2019
     projection_end_year = 2080
     discounting_rate = 10
+    write_timeseries = True # Set to False if only the NPVs are needed
     main(CONFIG,summary_results_folder,
         timeseries_results_folder,
         discounted_results_folder,
         network_csv,
         baseline_year=baseline_year,
         projection_end_year=projection_end_year,
-        discounting_rate=discounting_rate)
+        discounting_rate=discounting_rate,
+        write_timeseries=write_timeseries)
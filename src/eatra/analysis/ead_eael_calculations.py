@@ -3,6 +3,7 @@
 """
 import sys
 import os
+from functools import lru_cache
 
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -17,19 +18,37 @@ from .analysis_utils import *
 from tqdm import tqdm
 tqdm.pandas()
 
+def economic_loss_year(time_epoch):
+    """Year of the economic losses of an epoch, epochs before 2030 use the 2019 losses
+    """
+    if str(time_epoch).isdigit() is True:
+        year = int(str(time_epoch))
+        if year < 2030:
+            year = 2019
+    else:
+        year = 2019
+
+    return year
+
+@lru_cache(maxsize=None)
+def read_economic_losses(economic_loss_scenario,year,dataframe_id_column):
+    """Read the economic losses of a year once, indexed by the asset IDs
+    """
+    loss_df = pd.read_csv(os.path.join(
+                                economic_loss_scenario,
+                                f"economic_losses_{year}.csv"),
+                                usecols=[dataframe_id_column,"economic_loss"])
+    return loss_df.groupby(dataframe_id_column)["economic_loss"].sum()
+
 def add_economic_loss_estimates(dataframe,dataframe_id_column,time_epoch,economic_loss_scenario):
     if economic_loss_scenario != "none":
-        if str(time_epoch).isdigit() is True:
-            year = int(str(time_epoch))
-            if year < 2030:
-                year = 2019
-        else:
-            year = 2019
-        loss_df = pd.read_csv(os.path.join(
-                                    economic_loss_scenario,
-                                    f"economic_losses_{year}.csv"))
-        dataframe = pd.merge(dataframe,loss_df[[dataframe_id_column,"economic_loss"]],
-                        how="left",on=[dataframe_id_column]).fillna(0)
+        loss_df = read_economic_losses(economic_loss_scenario,
+                                        economic_loss_year(time_epoch),
+                                        dataframe_id_column)
+        # Assets without economic losses take the 0 added at the end of the losses
+        loss_index = loss_df.index.get_indexer(dataframe[dataframe_id_column].values)
+        dataframe = dataframe.copy()
+        dataframe["economic_loss"] = np.append(loss_df.to_numpy(),0)[loss_index]
         dataframe["economic_loss_unit"] = "US$/day"
     
     return dataframe
@@ -48,6 +67,7 @@ def main(config,results_folder,
 
     direct_damages_results = os.path.join(results_data_path,results_folder)
     asset_data_details = pd.read_csv(network_csv)
+    scenario_columns = ["hazard","rcp","epoch","confidence","subsidence","model"]
 
     for asset_info in asset_data_details.itertuples():
         asset_id = asset_info.asset_id_column
@@ -57,110 +77,82 @@ def main(config,results_folder,
                             f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_direct_damages_parameter_set_{set_count}.parquet"
                             )
         if os.path.isfile(damage_file) is True:
-            expected_damages = []
-            total_losses = []
             df = pd.read_parquet(damage_file)
-            hazard_columns = [c for c in df.columns.values.tolist() if c not in [
-                                                                    asset_id,
-                                                                    'damage_cost_unit'
-                                                                    'exposure']]
-            df = df.groupby([asset_id,'damage_cost_unit'])[hazard_columns].sum().reset_index()
             hazard_data_details = pd.read_csv(hazard_csv,encoding="latin1").fillna(0)
-            hazard_data_details = hazard_data_details[hazard_data_details.key.isin(hazard_columns)]
-            # haz_rcp_epoch_confidence = list(set(hazard_data_details.set_index(["hazard","rcp","epoch","confidence"]).index.values.tolist()))
-            haz_rcp_epoch_confidence_subsidence_model = list(set(hazard_data_details.set_index(["hazard","rcp","epoch","confidence","subsidence","model"]).index.values.tolist()))
-            # for i,(haz,rcp,epoch,confidence) in enumerate(haz_rcp_epoch_confidence):
-            for i,(haz,rcp,epoch,confidence,subsidence,model) in enumerate(haz_rcp_epoch_confidence_subsidence_model):
-                haz_df = hazard_data_details[
-                                    (hazard_data_details.hazard == haz
-                                    ) & (
-                                    hazard_data_details.rcp == rcp
-                                    ) & (
-                                    hazard_data_details.epoch == epoch
-                                    ) & (
-                                    hazard_data_details.confidence == confidence
-                                    ) & (
-                                    hazard_data_details.subsidence == subsidence
-                                    ) & (
-                                    hazard_data_details.model == model
-                                    )]
-                haz_cols, haz_rps = map(list,list(zip(*sorted(
-                                            list(zip(haz_df.key.values.tolist(),
-                                            haz_df.rp.values.tolist()
-                                            )),key=lambda x:x[-1],reverse=True))))
-                haz_prob = [1.0/rp for rp in haz_rps]
-                df = add_economic_loss_estimates(df,
-                                                    asset_info.asset_id_column,
-                                                    epoch,
-                                                    os.path.join(results_data_path,asset_info.economic_loss_scenarios))
-                if 'economic_loss' in df.columns.values.tolist():
-                    index_columns = [asset_id,"damage_cost_unit","economic_loss_unit"]
-                    loss_column = ["economic_loss"]
-                    losses = df[index_columns + loss_column + haz_cols].copy()
-                    losses[haz_cols] = losses["economic_loss"].to_numpy()[:,None]*np.where(losses[haz_cols]>0,1,0)
-                    losses.drop("economic_loss",axis=1,inplace=True)
-                    total_losses.append(losses)
-                    del losses
-                else:
-                    index_columns = [asset_id,"damage_cost_unit"]
-                    loss_column = []
-
-                damages = df[index_columns + loss_column + haz_cols]
-                df.drop("economic_loss",axis=1,inplace=True)
-                damages["hazard"] = haz
-                damages["rcp"] = rcp
-                damages["epoch"] = epoch
-                damages["confidence"] = confidence
-                damages["subsidence"] = subsidence
-                damages["model"] = model
-                damages.columns = index_columns + loss_column + haz_prob + ["hazard","rcp","epoch","confidence","subsidence","model"] 
-                index_columns += ["hazard","rcp","epoch","confidence","subsidence","model"] 
-                damages = damages[damages[haz_prob].sum(axis=1) > 0]
-
-                expected_damage_df = risks(damages,index_columns,haz_prob,
-                                            "EAD",
-                                            flood_protection_period=flood_protection_period,
-                                            flood_protection_name=flood_protection_name)
-                if 'economic_loss' in damages.columns.values.tolist():
-                    losses = damages.copy()
-                    losses.columns = losses.columns.map(str)
-                    losses[[str(h) for h in haz_prob]] = losses["economic_loss"].to_numpy()[:,None]*np.where(losses[[str(h) for h in haz_prob]]>0,1,0)
-                    economic_loss_df = risks(losses,index_columns,haz_prob,
-                                            "EAEL",
-                                            flood_protection_period=flood_protection_period,
-                                            flood_protection_name=flood_protection_name
-                                            )
-                    expected_damage_df = pd.merge(expected_damage_df,economic_loss_df,how='left',on=index_columns).fillna(0)
-                    del economic_loss_df
-
-                expected_damages.append(expected_damage_df)
-                del expected_damage_df
-
-            expected_damages = pd.concat(expected_damages,axis=0,ignore_index=True)
-            expected_loss_columns = [c for c in expected_damages.columns.values.tolist() if "EAD_" in c or "EAEL_" in c]
-            expected_damages = expected_damages[expected_damages[expected_loss_columns].sum(axis=1) > 0]
+            hazard_data_details = hazard_data_details[hazard_data_details.key.isin(df.columns.values.tolist())]
+            """Order the hazard keys by scenario and by ascending probability within each scenario
+                All scenarios are then integrated together as a matrix product of damages and weights
+            """
+            hazard_data_details["probability"] = 1.0/hazard_data_details["rp"]
+            hazard_data_details = hazard_data_details.sort_values(by=scenario_columns + ["probability"])
+            hazard_data_details["scenario"] = hazard_data_details.groupby(scenario_columns,sort=False).ngroup()
+            scenarios = hazard_data_details.drop_duplicates("scenario")[scenario_columns]
+            hazard_columns = hazard_data_details.key.values.tolist()
+            scenario_index = hazard_data_details.scenario.values
+
+            df = df.groupby([asset_id,'damage_cost_unit'])[hazard_columns].sum().reset_index()
+            damages = df[hazard_columns].to_numpy(dtype="float64")
+            weights = risk_integration_weights(scenario_index,
+                                            hazard_data_details.probability.values,
+                                            flood_protection_period=flood_protection_period)
+            scenario_damages = np.zeros((len(hazard_columns),len(scenarios.index)))
+            scenario_damages[np.arange(len(hazard_columns)),scenario_index] = 1
+            # Assets with some damages in a scenario
+            scenario_damages = (damages @ scenario_damages) > 0
+
+            index_columns = [asset_id,"damage_cost_unit"]
+            ead_column = expected_risk_column_name("EAD",
+                                    flood_protection_period=flood_protection_period,
+                                    flood_protection_name=flood_protection_name)
+            expected_values = {ead_column:damages @ weights}
+
+            economic_loss_scenario = asset_info.economic_loss_scenarios
+            if economic_loss_scenario != "none":
+                economic_loss_scenario = os.path.join(results_data_path,economic_loss_scenario)
+            # Economic losses of each asset for each year of the epochs
+            years, epoch_index = np.unique([economic_loss_year(epoch) for epoch in scenarios["epoch"].values],
+                                        return_inverse=True)
+            losses = [add_economic_loss_estimates(df[[asset_id]],asset_id,year,economic_loss_scenario) for year in years]
+            total_losses = None
+            if len(losses) > 0 and 'economic_loss' in losses[0].columns.values.tolist():
+                index_columns += ["economic_loss_unit"]
+                df["economic_loss_unit"] = losses[0]["economic_loss_unit"].values
+                losses = np.column_stack([l["economic_loss"].to_numpy(dtype="float64") for l in losses])[:,epoch_index]
+                damaged = np.where(damages > 0,1.0,0.0)
+                eael_column = expected_risk_column_name("EAEL",
+                                    flood_protection_period=flood_protection_period,
+                                    flood_protection_name=flood_protection_name)
+                expected_values[eael_column] = losses*(damaged @ weights)
+                total_losses = df[[asset_id,"economic_loss_unit"]].copy()
+                total_losses[hazard_columns] = losses[:,scenario_index]*damaged
+                del damaged
+            del damages, weights, losses
+
+            scenario_damages &= (sum(expected_values.values()) > 0)
+            # Write the assets of each scenario next to each other
+            scenario_values, asset_values = np.nonzero(scenario_damages.T)
+            expected_damages = df[index_columns].iloc[asset_values].reset_index(drop=True)
+            expected_damages[scenario_columns] = scenarios.iloc[scenario_values].reset_index(drop=True)
+            for column,values in expected_values.items():
+                expected_damages[column] = values[asset_values,scenario_values]
             expected_damages["cost_uncertainty_parameter"] = cost_uncertainty_parameter
             expected_damages["damage_uncertainty_parameter"] = damage_uncertainty_parameter
-            asset_damages_results = os.path.join(direct_damages_results,f"{asset_info.asset_gpkg}_{asset_info.asset_layer}")
-            if os.path.exists(asset_damages_results) == False:
-                os.mkdir(asset_damages_results)
-            expected_damages.to_csv(os.path.join(asset_damages_results,
-                        f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL_parameter_set_{set_count}.csv"),
-                        index=False)
+            del expected_values, scenario_damages
 
-            if len(total_losses) > 0:
-                total_losses = pd.concat(total_losses,axis=0,ignore_index=True)
-                loss_index_columns = [asset_info.asset_id_column,"economic_loss_unit"]
-                loss_coluumns = [c for c in total_losses.columns.values.tolist() if c not in loss_index_columns]
-                total_losses = total_losses.groupby(loss_index_columns)[loss_coluumns].sum().reset_index()
+            # Each parameter set writes its own folder of the EAD and EAEL dataset of the asset layer
+            write_partitioned_results(expected_damages,
+                        os.path.join(asset_damages_results,
+                            f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_EAD_EAEL",
+                            f"parameter_set={set_count}"),
+                        ["hazard","rcp","epoch"])
+
+            if total_losses is not None:
+                total_losses = total_losses.groupby([asset_id,"economic_loss_unit"])[hazard_columns].sum().reset_index()
                 
                 total_losses.to_parquet(os.path.join(
                         asset_damages_results,
                         f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_economic_losses_parameter_set_{set_count}.parquet"),
                         index=False)
-                total_losses.to_csv(os.path.join(asset_damages_results,
-                        f"{asset_info.asset_gpkg}_{asset_info.asset_layer}_economic_losses_parameter_set_{set_count}.csv"),
-                        index=False)
 
         print (f"* Done with {asset_info.asset_gpkg} {asset_info.asset_layer}")
                 
@@ -17,6 +17,8 @@ import igraph as ig
 import fiona
 import math
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from tqdm import tqdm
 tqdm.pandas()
 
@@ -398,117 +400,519 @@ def add_link_capacity(edges,road_future_usage=None,rail_future_usage=None,mode=N
 
     return edges
 
+def multi_modal_network_source_files(data_path):
+    """Paths of the network and capacity files the multi-modal network is built from
+    """
+    return {
+            "road":os.path.join(data_path,"networks","road","roads.gpkg"),
+            "rail":os.path.join(data_path,"networks","rail","rail.gpkg"),
+            "port":os.path.join(data_path,"networks","ports","port.gpkg"),
+            "multi":os.path.join(data_path,"networks","multimodal","multi_modal.gpkg"),
+            "road_capacity":os.path.join(data_path,"networks","road","roads_capacity_attributes.csv"),
+            "rail_capacity":os.path.join(data_path,"networks","rail","rail_capacity_attributes.csv")
+            }
+
+def build_multi_modal_network_cache(data_path=None,rebuild=False):
+    """Write the edges of the multi-modal network, without geometries, to a parquet cache
+
+    The cache is rebuilt whenever the modification time of one of its source files changes
+
+    Parameters
+    ----------
+    data_path - Path of the processed data folder, read from config.json if None
+    rebuild - Rebuild the cache even if it is up to date
+
+    Returns
+    -------
+    Path of the parquet file of the edges, with the costs, the baseline capacity, the rail design capacity,
+    the mode and the rail status. The from_node and to_node columns are dictionary columns that share
+    one dictionary of node names, so their indices are the integer ids of the nodes
+    """
+    if data_path is None:
+        data_path = load_config()["paths"]["data"]
+    edges_path = os.path.join(data_path,"networks","multimodal","multi_modal_network_edges.parquet")
+    source_mtimes = json.dumps(dict([(k,os.path.getmtime(v)) 
+                        for k,v in multi_modal_network_source_files(data_path).items()]),sort_keys=True)
+    if rebuild is False and os.path.exists(edges_path):
+        cache_metadata = pq.read_schema(edges_path).metadata or {}
+        if cache_metadata.get(b"source_mtimes") == source_mtimes.encode():
+            return edges_path
+
+    network_files = multi_modal_network_source_files(data_path)
+    network_edges = []
+    for mode in ["road","rail","port","multi"]:
+        edges = gpd.read_file(network_files[mode],layer="edges",ignore_geometry=True)
+        edges["mode"] = mode
+        edges = add_link_capacity(edges,mode=mode if mode in ("road","rail") else None)
+        if mode == "rail":
+            edges["design_capacity"] = 1.0/365*edges["design_capacity_tons_per_year"]
+        else:
+            edges["status"] = None
+            edges["design_capacity"] = np.nan
+        network_edges.append(edges[["from_node","to_node","edge_id",
+                                    "min_flow_cost","max_flow_cost",
+                                    "capacity","design_capacity",
+                                    "mode","status"]])
+    network_edges = pd.concat(network_edges,axis=0,ignore_index=True)
+
+    from_ids, to_ids, node_index = network_node_index(network_edges["from_node"].values,
+                                                    network_edges["to_node"].values)
+    node_names = pa.array(np.asarray(node_index.values,dtype=object),type=pa.string())
+    edges_table = pa.Table.from_pandas(network_edges.drop(["from_node","to_node"],axis=1),preserve_index=False)
+    edges_table = edges_table.add_column(0,"from_node",pa.DictionaryArray.from_arrays(pa.array(from_ids),node_names))
+    edges_table = edges_table.add_column(1,"to_node",pa.DictionaryArray.from_arrays(pa.array(to_ids),node_names))
+    edges_table = edges_table.replace_schema_metadata({**(edges_table.schema.metadata or {}),
+                                                        b"source_mtimes":source_mtimes.encode()})
+    # The cache is written to a temporary name and moved into place, so readers never see a partly written file
+    temporary_path = f"{edges_path}.{os.getpid()}.tmp"
+    pq.write_table(edges_table,temporary_path)
+    os.replace(temporary_path,edges_path)
+
+    return edges_path
+
+def load_multi_modal_network_edges(modes=["road","rail","port","multi"],rail_status=None):
+    """Read the cached edges of the multi-modal network, building the cache if it is out of date
+
+    Parameters
+    ----------
+    modes - List of network modes to include
+    rail_status - List of rail line statuses to include, or None for all of them
+
+    Returns
+    -------
+    network_edges - Pandas DataFrame of the cached edges with integer from_id and to_id
+    node_names - Numpy array of the node_id of each integer node id
+    """
+    edges_table = pq.read_table(build_multi_modal_network_cache())
+    from_nodes = edges_table.column("from_node")
+    to_nodes = edges_table.column("to_node")
+    node_names = from_nodes.chunk(0).dictionary
+    if all(c.dictionary.equals(node_names) for c in from_nodes.chunks + to_nodes.chunks):
+        from_ids = np.concatenate([c.indices.to_numpy() for c in from_nodes.chunks]).astype(np.int32)
+        to_ids = np.concatenate([c.indices.to_numpy() for c in to_nodes.chunks]).astype(np.int32)
+        node_names = node_names.to_numpy(zero_copy_only=False)
+    else:
+        # Older parquet writers do not keep the shared dictionary, so the node ids are found again
+        from_ids, to_ids, node_index = network_node_index(np.asarray(from_nodes.to_pandas(),dtype=object),
+                                                        np.asarray(to_nodes.to_pandas(),dtype=object))
+        node_names = node_index.values
+    network_edges = edges_table.drop(["from_node","to_node"]).to_pandas()
+    network_edges.insert(0,"from_id",from_ids)
+    network_edges.insert(1,"to_id",to_ids)
+    network_edges = network_edges[network_edges["mode"].isin(modes)]
+    if rail_status is not None:
+        network_edges = network_edges[
+                            (network_edges["mode"] != "rail") | (network_edges["status"].isin(rail_status))
+                            ]
+
+    return network_edges.reset_index(drop=True), node_names
+
+def scenario_link_capacity(network_edges,road_future_usage=None,rail_future_usage=None):
+    """Capacities of the cached network edges with the future usage factors of a scenario, as in add_link_capacity
+    """
+    capacity = network_edges["capacity"].values.astype(float)
+    if road_future_usage is not None:
+        capacity = np.where(network_edges["mode"].values == "road",(1+road_future_usage)*capacity,capacity)
+    if rail_future_usage is not None:
+        capacity = np.where(network_edges["mode"].values == "rail",
+                        rail_future_usage*network_edges["design_capacity"].values,capacity)
+    return capacity
+
+def multi_modal_network_dataframe(network_edges,node_names,capacity=None):
+    """Network dataframe of the cached edges with the node names and capacities used in the flow assignments
+    """
+    network_df = pd.DataFrame({"from_node":node_names[network_edges["from_id"].values],
+                                "to_node":node_names[network_edges["to_id"].values],
+                                "edge_id":network_edges["edge_id"].values,
+                                "min_flow_cost":network_edges["min_flow_cost"].values,
+                                "max_flow_cost":network_edges["max_flow_cost"].values})
+    network_df["capacity"] = network_edges["capacity"].values if capacity is None else capacity
+    return network_df
+
+def network_node_index(from_nodes,to_nodes):
+    """Registry of the nodes of a network, which maps their names to dense integer ids
+
+    Parameters
+    ----------
+    from_nodes - Array of the from node names of the network edges
+    to_nodes - Array of the to node names of the network edges
+
+    Returns
+    -------
+    from_ids - Numpy array of the integer ids of the from nodes
+    to_ids - Numpy array of the integer ids of the to nodes
+    node_index - Pandas Index of the node names, whose positions are their integer ids
+    """
+    node_ids, node_names = pd.factorize(np.concatenate([np.asarray(from_nodes),np.asarray(to_nodes)]))
+    node_ids = node_ids.astype(np.int32)
+    num_edges = len(from_nodes)
+    return node_ids[:num_edges], node_ids[num_edges:], pd.Index(node_names)
+
+def graph_from_node_ids(from_ids,to_ids,node_names,edge_attributes=None,directed=False):
+    """igraph network whose vertex ids are the integer node ids of network_node_index
+
+    Parameters
+    ----------
+    from_ids - Array of the integer from node ids of the edges
+    to_ids - Array of the integer to node ids of the edges
+    node_names - Array of the node names of each integer node id, stored as the vertex names
+    edge_attributes - Dictionary of edge attribute names and their arrays
+    directed - Boolean condition to create a directed graph
+
+    Returns
+    -------
+    igraph network structure
+    """
+    G = ig.Graph(n=len(node_names),edges=np.column_stack([from_ids,to_ids]),directed=directed)
+    G.vs["name"] = list(node_names)
+    if edge_attributes is not None:
+        for attribute,values in edge_attributes.items():
+            G.es[attribute] = np.asarray(values).tolist()
+    return G
+
+def network_graph_from_dataframe(network_dataframe,edge_attributes=[],directed=False):
+    """igraph network of a network dataframe with from_node and to_node columns, built from integer node ids
+
+    Returns
+    -------
+    graph - igraph network structure, with edges in the order of the dataframe rows
+    node_index - Pandas Index of the node names, whose positions are the igraph vertex ids
+    """
+    from_ids, to_ids, node_index = network_node_index(network_dataframe["from_node"].values,
+                                                    network_dataframe["to_node"].values)
+    graph = graph_from_node_ids(from_ids,to_ids,node_index.values,
+                                edge_attributes=dict([(c,network_dataframe[c].values) for c in edge_attributes]),
+                                directed=directed)
+    return graph, node_index
+
+def multi_modal_network_graph(network_edges,node_names,capacity=None):
+    """Undirected igraph of the cached edges, built from the integer node ids
+    """
+    used_nodes, edge_nodes = np.unique(np.concatenate([network_edges["from_id"].values,
+                                                    network_edges["to_id"].values]),return_inverse=True)
+    num_edges = len(network_edges.index)
+    return graph_from_node_ids(edge_nodes[:num_edges],edge_nodes[num_edges:],node_names[used_nodes],
+                            edge_attributes={"edge_id":network_edges["edge_id"].values,
+                                        "min_flow_cost":network_edges["min_flow_cost"].values,
+                                        "max_flow_cost":network_edges["max_flow_cost"].values,
+                                        "capacity":network_edges["capacity"].values if capacity is None else capacity})
+
 def create_multi_modal_network_africa(modes=["road","rail","port","multi"],
                                 rail_status=["open"],
                                 road_future_usage=None,
                                 rail_future_usage=None,
                                 return_network=True):
-    network_columns = ["from_node","to_node","edge_id","min_flow_cost","max_flow_cost","capacity"]
-    road_edges = gpd.read_file(os.path.join(
-                        load_config()["paths"]["data"],
-                        "networks",
-                        "road",
-                        "roads.gpkg"), layer='edges')
-    road_edges["mode"] = "road"
-    road_edges = add_link_capacity(road_edges,road_future_usage=road_future_usage,mode="road")
-    rail_edges = gpd.read_file(os.path.join(
-                        load_config()["paths"]["data"],
-                        "networks",
-                        "rail",
-                        "rail.gpkg"),layer="edges")
-    rail_edges = rail_edges[rail_edges["status"].isin(rail_status)]
-    rail_edges["mode"] = "rail"
-    rail_edges = add_link_capacity(rail_edges,rail_future_usage=rail_future_usage,mode="rail")
-    port_edges = gpd.read_file(os.path.join(
-                        load_config()["paths"]["data"],
-                        "networks",
-                        "ports",
-                        "port.gpkg"),layer="edges")
-    port_edges["mode"] = "port"
-    port_edges = add_link_capacity(port_edges)
-    multi_modal_edges = gpd.read_file(os.path.join(
-                        load_config()["paths"]["data"],
-                        "networks",
-                        "multimodal",
-                        "multi_modal.gpkg"),layer="edges")
-    multi_modal_edges["mode"] = "multi"
-    multi_modal_edges = add_link_capacity(multi_modal_edges)
-    network_edges = pd.concat([road_edges,rail_edges,
-                        port_edges,multi_modal_edges],
-                        axis=0,ignore_index=True)
-    network_edges = network_edges[network_edges["mode"].isin(modes)][network_columns]
+    network_edges, node_names = load_multi_modal_network_edges(modes=modes,rail_status=rail_status)
+    capacity = scenario_link_capacity(network_edges,
+                                    road_future_usage=road_future_usage,
+                                    rail_future_usage=rail_future_usage)
     if return_network is True:
-        G = ig.Graph.TupleList(network_edges.itertuples(index=False), edge_attrs=list(network_edges.columns)[2:])
-        return G
+        return multi_modal_network_graph(network_edges,node_names,capacity=capacity)
+    else:
+        return multi_modal_network_dataframe(network_edges,node_names,capacity=capacity)
+
+def create_multi_modal_network_africa_scenarios(network_scenarios,
+                                modes=["road","rail","port","multi"]):
+    """Read the multi-modal network once and estimate the capacities of its edges in several scenarios
+
+    Parameters
+    ----------
+    network_scenarios - List of dictionaries with the rail_status, road_future_usage and rail_future_usage
+                        of each scenario, as in create_multi_modal_network_africa 
+    modes - List of network modes to include
+
+    Returns
+    -------
+    network_edges - Pandas DataFrame of the edges of all the scenarios, without capacities
+    capacities - Numpy array of shape (edges, scenarios) of the edge capacities in each scenario
+    scenario_edges - Boolean Numpy array of shape (edges, scenarios) of the edges in each scenario
+    """
+    rail_status = list(set(chain.from_iterable([sc.get("rail_status",["open"]) for sc in network_scenarios])))
+    network_edges, node_names = load_multi_modal_network_edges(modes=modes,rail_status=rail_status)
+
+    capacities = []
+    scenario_edges = []
+    for network_scenario in network_scenarios:
+        capacities.append(scenario_link_capacity(network_edges,
+                                    road_future_usage=network_scenario.get("road_future_usage"),
+                                    rail_future_usage=network_scenario.get("rail_future_usage")))
+        scenario_edges.append(
+                    (network_edges["mode"].values != "rail"
+                    ) | (network_edges["status"].isin(network_scenario.get("rail_status",["open"])).values))
+
+    network_df = multi_modal_network_dataframe(network_edges,node_names).drop("capacity",axis=1)
+    return network_df, np.column_stack(capacities), np.column_stack(scenario_edges)
+
+def select_network_scenario(network_edges,capacities,scenario_edges,scenario):
+    """Network dataframe of the edges of a scenario of create_multi_modal_network_africa_scenarios, with their capacities
+    """
+    in_scenario = scenario_edges[:,scenario]
+    network_df = network_edges[in_scenario].reset_index(drop=True)
+    network_df["capacity"] = capacities[in_scenario,scenario]
+    return network_df
+
+def path_index_arrays(edge_paths):
+    """Flatten paths of integer edge indexes into CSR style arrays
+
+    Parameters
+    ---------
+    edge_paths
+        List of lists or arrays of integer edge indexes
+
+    Returns
+    -------
+    path_offsets : numpy.ndarray
+        Start positions of each path in path_edges, with the total length appended at the end
+    path_edges : numpy.ndarray
+        Int32 edge indexes of all paths concatenated
+    """
+    path_lengths = np.fromiter((len(path) for path in edge_paths),dtype=np.int64,count=len(edge_paths))
+    path_offsets = np.zeros(len(path_lengths) + 1,dtype=np.int64)
+    np.cumsum(path_lengths,out=path_offsets[1:])
+    if path_offsets[-1] > 0:
+        path_edges = np.concatenate([np.asarray(path,dtype=np.int32) for path in edge_paths])
+    else:
+        path_edges = np.array([],dtype=np.int32)
+
+    return path_offsets, path_edges
+
+def encode_edge_paths(edge_paths,edge_ids=None):
+    """Map paths of string edge IDs to CSR style integer arrays
+
+    Parameters
+    ---------
+    edge_paths
+        List or Series of lists of string edge IDs
+    edge_ids
+        Optional array of edge IDs giving the integer index of each edge
+        If None the edges are indexed in their order of first appearance in the paths
+
+    Returns
+    -------
+    path_offsets : numpy.ndarray
+        Start positions of each path in path_edges, with the total length appended at the end
+    path_edges : numpy.ndarray
+        Int32 indexes of the edges of all paths concatenated
+    edge_ids : numpy.ndarray
+        Edge IDs corresponding to the integer edge indexes
+    """
+    path_lengths = np.fromiter((len(path) for path in edge_paths),dtype=np.int64,count=len(edge_paths))
+    path_offsets = np.zeros(len(path_lengths) + 1,dtype=np.int64)
+    np.cumsum(path_lengths,out=path_offsets[1:])
+    all_edges = np.fromiter(chain.from_iterable(edge_paths),dtype=object,count=path_offsets[-1])
+    if edge_ids is None:
+        path_edges, edge_ids = pd.factorize(all_edges)
     else:
-        return network_edges
+        path_edges = pd.Index(edge_ids).get_indexer(all_edges)
+
+    return path_offsets, path_edges.astype(np.int32), np.asarray(edge_ids)
+
+def select_path_arrays(path_offsets,path_edges,path_indexes):
+    """Select a subset of paths from CSR style path arrays
+
+    Parameters
+    ---------
+    path_offsets
+        Start positions of each path in path_edges, with the total length appended at the end
+    path_edges
+        Integer edge indexes of all paths concatenated
+    path_indexes
+        Integer indexes of the paths to select
+
+    Returns
+    -------
+    path_offsets : numpy.ndarray
+        Offsets of the selected paths
+    path_edges : numpy.ndarray
+        Edge indexes of the selected paths concatenated
+    """
+    path_indexes = np.asarray(path_indexes,dtype=np.int64)
+    path_lengths = np.diff(path_offsets)[path_indexes]
+    select_offsets = np.zeros(len(path_indexes) + 1,dtype=np.int64)
+    np.cumsum(path_lengths,out=select_offsets[1:])
+    positions = np.repeat(path_offsets[path_indexes] - select_offsets[:-1],path_lengths
+                    ) + np.arange(select_offsets[-1])
+
+    return select_offsets, path_edges[positions]
+
+def get_flow_paths_edge_ids_file(flow_paths_file):
+    return flow_paths_file.replace(".parquet","__edge_ids.parquet")
+
+def get_flow_paths_edge_index_file(flow_paths_file):
+    return flow_paths_file.replace(".parquet","__edge_path_index.npz")
+
+def build_edge_path_index(path_offsets,path_edges,num_edges):
+    """Create a CSR style inverted index from edges to the paths passing through them
+
+    Parameters
+    ---------
+    path_offsets
+        Start positions of each path in path_edges, with the total length appended at the end
+    path_edges
+        Integer edge indexes of all paths concatenated
+    num_edges
+        Total number of edges
+
+    Returns
+    -------
+    edge_offsets : numpy.ndarray
+        Start positions of the paths of each edge in edge_paths, with the total length appended at the end
+    edge_paths : numpy.ndarray
+        Int32 path indexes of all edges concatenated, in edge index order
+    """
+    path_index = np.repeat(np.arange(len(path_offsets) - 1,dtype=np.int32),np.diff(path_offsets))
+    edge_paths = path_index[np.argsort(path_edges,kind="stable")]
+    edge_offsets = np.zeros(num_edges + 1,dtype=np.int64)
+    np.cumsum(np.bincount(path_edges,minlength=num_edges),out=edge_offsets[1:])
+
+    return edge_offsets, edge_paths
+
+def read_edge_path_index(flow_paths_file):
+    """Read the edge to path index written next to the flow paths by write_flow_paths
+    """
+    edge_path_index = np.load(get_flow_paths_edge_index_file(flow_paths_file))
+    return edge_path_index["edge_offsets"], edge_path_index["edge_paths"]
+
+def write_flow_paths(flow_dataframe,edge_ids,flow_paths_file,edge_path_column="edge_path"):
+    """Write OD flow paths to parquet with integer encoded edge paths
+
+    The edge paths are stored as a large_list<int32> column of edge indexes,
+    whose int64 offsets allow more than 2^31 path edges in one file.
+    The edge IDs of the indexes and an inverted index from edges to paths
+    are written to separate files next to the flow paths
+
+    Parameters
+    ---------
+    flow_dataframe
+        Pandas DataFrame of OD flows with a column of lists of string edge IDs
+    edge_ids
+        Array of all edge IDs of the network, giving the integer index of each edge
+    flow_paths_file
+        Path of the output parquet file
+    edge_path_column
+        String name of column of edge paths
+    """
+    path_offsets, path_edges, edge_ids = encode_edge_paths(flow_dataframe[edge_path_column].values,
+                                                    edge_ids=edge_ids)
+    flow_table = pa.Table.from_pandas(flow_dataframe.drop(edge_path_column,axis=1),preserve_index=False)
+    flow_table = flow_table.append_column(edge_path_column,
+                                pa.LargeListArray.from_arrays(pa.array(path_offsets.astype(np.int64)),
+                                                        pa.array(path_edges)))
+    pq.write_table(flow_table,flow_paths_file)
+    pd.DataFrame(edge_ids,columns=["edge_id"]).to_parquet(get_flow_paths_edge_ids_file(flow_paths_file),
+                                                    index=False)
+    edge_offsets, edge_paths = build_edge_path_index(path_offsets,path_edges,len(edge_ids))
+    np.savez(get_flow_paths_edge_index_file(flow_paths_file),
+            edge_offsets=edge_offsets,edge_paths=edge_paths)
+
+def read_flow_paths(flow_paths_file,edge_path_column="edge_path"):
+    """Read OD flow paths written by write_flow_paths without parsing the edge paths
+
+    Parameters
+    ---------
+    flow_paths_file
+        Path of the parquet file of flow paths
+    edge_path_column
+        String name of column of edge paths
+
+    Returns
+    -------
+    flow_dataframe : pandas.DataFrame
+        OD flows without the edge path column
+    path_offsets : numpy.ndarray
+        Start positions of each path in path_edges, with the total length appended at the end
+    path_edges : numpy.ndarray
+        Int32 edge indexes of all paths concatenated
+    edge_ids : numpy.ndarray
+        Edge IDs corresponding to the integer edge indexes
+    """
+    flow_table = pq.read_table(flow_paths_file,memory_map=True)
+    edge_paths = flow_table.column(edge_path_column).combine_chunks()
+    path_offsets = edge_paths.offsets.to_numpy().astype(np.int64)
+    path_edges = edge_paths.values.to_numpy()[path_offsets[0]:path_offsets[-1]]
+    path_offsets -= path_offsets[0]
+    flow_dataframe = flow_table.drop([edge_path_column]).to_pandas()
+    edge_ids = pd.read_parquet(get_flow_paths_edge_ids_file(flow_paths_file))["edge_id"].values
+
+    return flow_dataframe, path_offsets, path_edges, edge_ids
+
+def get_flow_on_path_edges(path_offsets,path_edges,path_flows,num_edges):
+    """Sum the flows of paths onto their edges
+
+    Parameters
+    ---------
+    path_offsets
+        Start positions of each path in path_edges, with the total length appended at the end
+    path_edges
+        Integer edge indexes of all paths concatenated
+    path_flows
+        Numpy array of flows of each path, either 1-D or 2-D with one column per flow type
+    num_edges
+        Total number of edges
+
+    Returns
+    -------
+    edge_flows : numpy.ndarray
+        Flows on each edge, with the same number of dimensions as path_flows
+    """
+    path_flows = np.asarray(path_flows,dtype=float)
+    path_index = np.repeat(np.arange(len(path_offsets) - 1),np.diff(path_offsets))
+    if path_flows.ndim == 1:
+        return np.bincount(path_edges,weights=path_flows[path_index],minlength=num_edges)
+
+    edge_flows = np.zeros((num_edges,path_flows.shape[1]))
+    for c in range(path_flows.shape[1]):
+        edge_flows[:,c] = np.bincount(path_edges,weights=path_flows[path_index,c],minlength=num_edges)
+
+    return edge_flows
 
 def get_flow_on_edges(save_paths_df,edge_id_column,edge_path_column,
     flow_column):
-    """Write results to Shapefiles
-
-    Outputs ``gdf_edges`` - a shapefile with minimum and maximum tonnage flows of all
-    commodities/industries for each edge of network.
+    """Sum the flows of OD paths onto the edges of the network
 
     Parameters
     ---------
     save_paths_df
-        Pandas DataFrame of OD flow paths and their tonnages
-    industry_columns
-        List of string names of all OD commodities/industries indentified
-    min_max_exist
-        List of string names of commodity/industry columns for which min-max tonnage column names already exist
-    gdf_edges
-        GeoDataFrame of network edge set
-    save_csv
-        Boolean condition to tell code to save created edge csv file
-    save_shapes
-        Boolean condition to tell code to save created edge shapefile
-    shape_output_path
-        Path where the output shapefile will be stored
-    csv_output_path
-        Path where the output csv file will be stored
-
-    """
-    edge_flows = defaultdict(float)
-    for row in save_paths_df.itertuples():
-        for item in getattr(row,edge_path_column):
-            edge_flows[item] += getattr(row,flow_column)
-
-    return pd.DataFrame([(k,v) for k,v in edge_flows.items()],columns=[edge_id_column,flow_column])
-
-
-# def get_flow_paths_indexes_of_edges(flow_dataframe,path_criteria):
-#     edge_path_index = defaultdict(list)
-#     for k,v in zip(chain.from_iterable(flow_dataframe[path_criteria].ravel()), flow_dataframe.index.repeat(flow_dataframe[path_criteria].str.len()).tolist()):
-#         edge_path_index[k].append(v)
-
-#     del flow_dataframe
-#     return edge_path_index
-
-def get_flow_paths_indexes_of_edges(flow_dataframe,path_criteria):
-    edge_path_index = defaultdict(list)
-    for v in flow_dataframe.itertuples():
-        for k in getattr(v,path_criteria):
-            edge_path_index[k].append(v.Index)
-
-    del flow_dataframe
-    return edge_path_index
-
-def get_path_indexes_for_edges(edge_ids_with_paths,selected_edge_list):
-    return list(
-            set(
-                list(
-                    chain.from_iterable([
-                        path_idx for path_key,path_idx in edge_ids_with_paths.items() if path_key in selected_edge_list
-                                        ]
-                                        )
-                    )
-                )
-            )
+        Pandas DataFrame of OD flow paths and their flows
+    edge_id_column
+        String name of the edge ID column in the output
+    edge_path_column
+        String name of column of lists of edge IDs in save_paths_df
+    flow_column
+        String name or list of string names of flow columns to sum onto edges
+
+    Returns
+    -------
+    edge_flows : pandas.DataFrame
+        Edge IDs of all edges along the paths and their total flows
+    """
+    flow_columns = [flow_column] if isinstance(flow_column,str) else list(flow_column)
+    path_offsets, path_edges, edge_ids = encode_edge_paths(save_paths_df[edge_path_column].values)
+    edge_flows = get_flow_on_path_edges(path_offsets,path_edges,
+                                save_paths_df[flow_columns].to_numpy(dtype=float),len(edge_ids))
+    edge_flows = pd.DataFrame(edge_flows,columns=flow_columns)
+    edge_flows.insert(0,edge_id_column,edge_ids)
+
+    return edge_flows
+
+
+def get_path_indexes_for_edges(edge_offsets,edge_paths,edge_indexes):
+    """Find the indexes of the paths which pass through any of the selected edges
+
+    Parameters
+    ---------
+    edge_offsets
+        Start positions of the paths of each edge in edge_paths, with the total length appended at the end
+    edge_paths
+        Integer path indexes of all edges concatenated
+    edge_indexes
+        Integer indexes of the selected edges
+    """
+    _, path_indexes = select_path_arrays(edge_offsets,edge_paths,edge_indexes)
+    return np.unique(path_indexes)
 
 def network_od_path_estimations(graph,
-    source, target, cost_criteria):
+    source, target, cost_criteria, edge_ids=None, edge_costs=None):
     """Estimate the paths, distances, times, and costs for given OD pair
 
     Parameters
@@ -528,6 +932,10 @@ def network_od_path_estimations(graph,
     time_criteria : str
         name of time criteria to be used: min_time or max_time
     fixed_cost : bool
+    edge_ids : numpy.ndarray, optional
+        edge ID's of the graph edges, read from the graph if not given
+    edge_costs : numpy.ndarray, optional
+        costs of the graph edges, read from the graph if not given
 
     Returns
     -------
@@ -541,23 +949,15 @@ def network_od_path_estimations(graph,
         estimated generalised costs of routes
 
     """
-    paths = graph.get_shortest_paths(source, target, weights=cost_criteria, output="epath")
-
+    if edge_ids is None:
+        edge_ids = np.array(graph.es['edge_id'],dtype=object)
+    if edge_costs is None:
+        edge_costs = np.array(graph.es[cost_criteria],dtype=float)
 
-    edge_path_list = []
-    path_gcost_list = []
-    # for p in range(len(paths)):
-    for path in paths:
-        edge_path = []
-        path_gcost = 0
-        if path:
-            for n in path:
-                edge_path.append(graph.es[n]['edge_id'])
-                path_gcost += graph.es[n][cost_criteria]
-
-        edge_path_list.append(edge_path)
-        path_gcost_list.append(path_gcost)
+    paths = graph.get_shortest_paths(source, target, weights=edge_costs, output="epath")
 
+    edge_path_list = [edge_ids[path].tolist() for path in paths]
+    path_gcost_list = [edge_costs[path].sum() for path in paths]
     
     return edge_path_list, path_gcost_list
 
@@ -596,14 +996,25 @@ def network_od_paths_assembly(points_dataframe, graph,
 
     """
     save_paths = []
+    # Read the edge attributes once for all origins
+    edge_ids = np.array(graph.es['edge_id'],dtype=object)
+    edge_costs = np.array(graph.es[cost_criteria],dtype=float)
     points_dataframe = points_dataframe.set_index('origin_id')
     origins = list(set(points_dataframe.index.values.tolist()))
     for origin in origins:
         try:
             destinations = list(set(points_dataframe.loc[[origin], 'destination_id'].values.tolist()))
 
-            get_path, get_gcost = network_od_path_estimations(
-                graph, origin, destinations, cost_criteria)
+            if store_edge_path is True:
+                get_path, get_gcost = network_od_path_estimations(
+                    graph, origin, destinations, cost_criteria,
+                    edge_ids=edge_ids, edge_costs=edge_costs)
+            else:
+                # Only the costs are needed, so skip building the paths
+                get_gcost = np.array(graph.distances(origin, destinations, weights=edge_costs)[0])
+                get_gcost[~np.isfinite(get_gcost)] = 0
+                get_gcost = get_gcost.tolist()
+                get_path = [[]]*len(destinations)
 
             # tons = points_dataframe.loc[[origin], tonnage_column].values
             save_paths += list(zip([origin]*len(destinations),
@@ -634,122 +1045,212 @@ def network_od_paths_assembly(points_dataframe, graph,
 
     return save_paths_df
 
-def update_flow_and_overcapacity(od_dataframe,network_dataframe,flow_column,edge_id_column="edge_id",subtract=False):
-    edge_flows = get_flow_on_edges(od_dataframe,edge_id_column,"edge_path",flow_column)
-    edge_flows.rename(columns={flow_column:"added_flow"},inplace=True)
-    network_dataframe = pd.merge(network_dataframe,edge_flows,how="left",on=[edge_id_column]).fillna(0)
-    del edge_flows
-    if subtract is True:
-        network_dataframe[flow_column] = network_dataframe[flow_column] - network_dataframe["added_flow"]
-    else:
-        network_dataframe[flow_column] += network_dataframe["added_flow"]
-    network_dataframe["over_capacity"] = network_dataframe["capacity"] - network_dataframe[flow_column]
-
-    return network_dataframe
-
-def find_minimal_flows_along_overcapacity_paths(over_capacity_ods,network_dataframe,over_capacity_edges,edge_id_paths,flow_column):
-    over_capacity_edges_df = pd.DataFrame([
-                                (
-                                    path_key,path_idx
-                                ) for path_key,path_idx in edge_id_paths.items() if path_key in over_capacity_edges
-                            ],columns = ["edge_id","path_indexes"]
-                                )
-    over_capacity_edges_df = pd.merge(over_capacity_edges_df,
-                                network_dataframe[["edge_id","residual_capacity","added_flow"]],
-                                how="left",
-                                on=["edge_id"])
-    # print (over_capacity_edges_df)
-    # print (over_capacity_ods)
-    over_capacity_edges_df["edge_path_flow"] = over_capacity_edges_df.progress_apply(
-                                        lambda x:over_capacity_ods[
-                                            over_capacity_ods.path_indexes.isin(x.path_indexes)
-                                            ][flow_column].values,
-                                        axis=1
-                                        )
-    over_capacity_edges_df["edge_path_flow_cor"] = over_capacity_edges_df.progress_apply(
-                                        lambda x:list(
-                                            1.0*x.residual_capacity*x.edge_path_flow/x.added_flow),
-                                        axis=1
-                                        )
-    over_capacity_edges_df["path_flow_tuples"] = over_capacity_edges_df.progress_apply(
-                                        lambda x:list(zip(x.path_indexes,x.edge_path_flow_cor)),axis=1)
-
-    min_flows = []
-    for r in over_capacity_edges_df.itertuples():
-        min_flows += r.path_flow_tuples
-
-    min_flows = pd.DataFrame(min_flows,columns=["path_indexes","min_flows"])
-    min_flows = min_flows.sort_values(by=["min_flows"],ascending=True)
-    min_flows = min_flows.drop_duplicates(subset=["path_indexes"],keep="first")
-
-    over_capacity_ods = pd.merge(over_capacity_ods,min_flows,how="left",on=["path_indexes"])
-    del min_flows, over_capacity_edges_df
-    over_capacity_ods["residual_flows"] = over_capacity_ods[flow_column] - over_capacity_ods["min_flows"]
-
-    return over_capacity_ods
+def network_od_edge_index_paths(points_dataframe,graph,edge_weights):
+    """Estimate least cost paths of OD pairs as arrays of igraph edge indexes
+
+    Parameters
+    ---------
+    points_dataframe
+        Pandas DataFrame of OD nodes with origin_id and destination_id columns of igraph vertex ids
+    graph
+        igraph network structure
+    edge_weights
+        Numpy array of edge costs indexed by igraph edge index
+        Edges with infinite weights are treated as removed from the network
+
+    Returns
+    -------
+    points_dataframe : pandas.DataFrame
+        OD dataframe with a new gcost column, which is 0 if no path is found
+    edge_paths : list[numpy.ndarray]
+        Arrays of igraph edge indexes of the paths, in the order of the OD dataframe rows
+    """
+    points_dataframe = points_dataframe.reset_index(drop=True)
+    destination_ids = points_dataframe["destination_id"].values
+    edge_paths = [np.array([],dtype=np.int32)]*len(points_dataframe.index)
+    gcost = np.zeros(len(points_dataframe.index))
+    for origin,od_index in points_dataframe.groupby("origin_id").indices.items():
+        destinations, destination_index = np.unique(destination_ids[od_index],return_inverse=True)
+        paths = graph.get_shortest_paths(int(origin),destinations.tolist(),weights=edge_weights,output="epath")
+        paths = [np.array(path,dtype=np.int32) for path in paths]
+        for idx,d_idx in zip(od_index,destination_index):
+            edge_paths[idx] = paths[d_idx]
+            gcost[idx] = edge_weights[paths[d_idx]].sum()
+
+    # Paths along removed edges are not valid paths
+    gcost[~np.isfinite(gcost)] = 0
+    points_dataframe["gcost"] = gcost
+    return points_dataframe, edge_paths
+
+def od_costs_and_edge_use(points_dataframe,graph,edge_weights,edge_indexes):
+    """Estimate least costs of OD pairs without building paths,
+    and find the OD pairs whose least cost paths could pass through any of the selected edges
+
+    An edge u-v is on a least cost path from o to d if d(o,u) + w(u,v) + d(v,d) equals d(o,d),
+    in either direction of the edge
+
+    Parameters
+    ---------
+    points_dataframe
+        Pandas DataFrame of OD nodes with origin_id and destination_id columns of igraph vertex ids
+    graph
+        igraph network structure
+    edge_weights
+        Numpy array of edge costs indexed by igraph edge index
+    edge_indexes
+        Integer indexes of the selected edges
+
+    Returns
+    -------
+    gcost : numpy.ndarray
+        Least costs of the OD pairs, which are 0 if no path is found
+    uses_edges : numpy.ndarray
+        Boolean array of OD pairs with a least cost path through any of the selected edges
+    Returns None if the selected edges have more nodes than there are origins,
+    in which case finding the paths directly is cheaper
+    """
+    origins, origin_index = np.unique(points_dataframe["origin_id"].values,return_inverse=True)
+    destinations, destination_index = np.unique(points_dataframe["destination_id"].values,return_inverse=True)
+    edge_nodes = np.array(graph.get_edgelist(),dtype=np.int64).reshape(-1,2)[edge_indexes]
+    edge_node_ids, edge_node_index = np.unique(edge_nodes,return_inverse=True)
+    if len(edge_node_ids) > len(origins):
+        return None
+
+    edge_node_index = edge_node_index.reshape(-1,2)
+    destination_ids = destinations
+    # The targets must be unique, so the costs to destinations and edge nodes are found in one list
+    target_ids = np.unique(np.concatenate([destination_ids,edge_node_ids]))
+    origin_costs = np.array(graph.distances(origins.tolist(),
+                                target_ids.tolist(),
+                                weights=edge_weights)).reshape(len(origins),-1)
+    gcost = origin_costs[:,np.searchsorted(target_ids,destination_ids)][origin_index,destination_index]
+    uses_edges = np.zeros(len(gcost),dtype=bool)
+    if len(edge_indexes) > 0:
+        edge_node_costs = np.array(graph.distances(edge_node_ids.tolist(),destination_ids.tolist(),
+                                weights=edge_weights)).reshape(len(edge_node_ids),-1)
+        to_nodes = origin_costs[:,np.searchsorted(target_ids,edge_node_ids)]
+        cost_tolerance = 1e-9*(1 + gcost)
+        for e,(u,v) in enumerate(edge_node_index):
+            w = edge_weights[edge_indexes[e]]
+            via_u_v = to_nodes[origin_index,u] + w + edge_node_costs[v,destination_index]
+            via_v_u = to_nodes[origin_index,v] + w + edge_node_costs[u,destination_index]
+            uses_edges |= (np.minimum(via_u_v,via_v_u) <= gcost + cost_tolerance) & np.isfinite(gcost)
+
+    gcost[~np.isfinite(gcost)] = 0
+    return gcost, uses_edges
 
 def od_flow_allocation_capacity_constrained(flow_ods,network_dataframe,flow_column,cost_column,store_edge_path=True):
-    network_dataframe["over_capacity"] = network_dataframe["capacity"] - network_dataframe[flow_column]
+    """Assign OD flows to least cost paths on a capacity constrained network
+
+    The graph is built once, and edge flows and capacities are kept in arrays indexed by igraph edges.
+    In each iteration the saturated edges are removed by setting their costs to infinity.
+    Flows along paths with over capacity edges are reduced in proportion to the residual capacities
+    of the edges, and the remaining flows are rerouted in the next iteration.
+
+    When the edge paths are not stored, only the edges with less residual capacity than the total OD flows
+    can go over capacity. OD flows whose least cost paths avoid these edges are assigned from
+    their least costs alone, and paths are only built for the rest.
+
+    Parameters
+    ---------
+    flow_ods
+        Pandas DataFrame of OD flows with origin_id, destination_id and flow columns
+    network_dataframe
+        Pandas DataFrame of network edges with from_node, to_node, edge_id, capacity, cost and flow columns
+    flow_column
+        String name of column of OD flows and existing edge flows
+    cost_column
+        String name of column of edge costs
+    store_edge_path
+        Boolean condition to return the edge paths of the assigned flows
+
+    Returns
+    -------
+    capacity_ods : list[pandas.DataFrame]
+        Assigned OD flows, with edge_path and gcost columns
+    unassigned_paths : list[pandas.DataFrame]
+        OD flows which could not be assigned to the network
+    """
+    network_dataframe = network_dataframe.reset_index(drop=True)
+    graph, node_index = network_graph_from_dataframe(network_dataframe)
+    edge_ids = network_dataframe["edge_id"].values
+    edge_costs = network_dataframe[cost_column].values.astype(float)
+    edge_capacity = network_dataframe["capacity"].values.astype(float)
+    edge_flows = network_dataframe[flow_column].values.astype(float)
+    num_edges = len(edge_ids)
+
     capacity_ods = []
     unassigned_paths = []
+    # The OD flows carry the integer node ids of the graph while they are assigned
+    origin_ids = node_index.get_indexer(flow_ods["origin_id"].values)
+    destination_ids = node_index.get_indexer(flow_ods["destination_id"].values)
+    in_graph = (origin_ids >= 0) & (destination_ids >= 0)
+    unassigned_paths.append(flow_ods[~in_graph])
+    flow_ods = flow_ods[in_graph]
+    flow_ods["origin_id"] = origin_ids[in_graph]
+    flow_ods["destination_id"] = destination_ids[in_graph]
     while len(flow_ods.index) > 0:
-        # print (flow_ods)
-        graph = ig.Graph.TupleList(network_dataframe[network_dataframe["over_capacity"] > 1e-3].itertuples(index=False), 
-                        edge_attrs=list(network_dataframe[network_dataframe["over_capacity"] > 1e-3].columns)[2:])
-        graph_nodes = [x['name'] for x in graph.vs]
-        unassigned_paths.append(flow_ods[~((flow_ods["origin_id"].isin(graph_nodes)) & (flow_ods["destination_id"].isin(graph_nodes)))])
-        flow_ods = flow_ods[(flow_ods["origin_id"].isin(graph_nodes)) & (flow_ods["destination_id"].isin(graph_nodes))]
-        if len(flow_ods.index) > 0:
-            flow_ods = network_od_paths_assembly(flow_ods,graph,cost_column)
-            unassigned_paths.append(flow_ods[flow_ods["gcost"] == 0])
-            flow_ods = flow_ods[flow_ods["gcost"] > 0]
-            if len(flow_ods.index) > 0:
-                # print (flow_ods)
-                network_dataframe["residual_capacity"] = network_dataframe["over_capacity"]
-                network_dataframe = update_flow_and_overcapacity(flow_ods,network_dataframe,flow_column)
-                over_capacity_edges = network_dataframe[network_dataframe["over_capacity"] < -1.0e-3]["edge_id"].values.tolist()
-                if len(over_capacity_edges) > 0:
-                    edge_id_paths = get_flow_paths_indexes_of_edges(flow_ods,"edge_path")
-                    edge_paths_overcapacity = get_path_indexes_for_edges(edge_id_paths,over_capacity_edges)
-                    if store_edge_path is False:
-                        cap_ods = flow_ods[~flow_ods.index.isin(edge_paths_overcapacity)]
-                        cap_ods.drop("edge_path",axis=1,inplace=True)
-                        capacity_ods.append(cap_ods)
-                        del cap_ods
-                    else:
-                        capacity_ods.append(flow_ods[~flow_ods.index.isin(edge_paths_overcapacity)])
-
-                    over_capacity_ods = flow_ods[flow_ods.index.isin(edge_paths_overcapacity)]
-                    over_capacity_ods["path_indexes"] = over_capacity_ods.index.values.tolist()
-                    over_capacity_ods = find_minimal_flows_along_overcapacity_paths(over_capacity_ods,network_dataframe,
-                                                                over_capacity_edges,edge_id_paths,flow_column)
-                    cap_ods = over_capacity_ods.copy() 
-                    cap_ods.drop(["path_indexes",flow_column,"residual_flows"],axis=1,inplace=True)
-                    cap_ods.rename(columns={"min_flows":flow_column},inplace=True)
-                    if store_edge_path is False:
-                        cap_ods.drop("edge_path",axis=1,inplace=True)
-                    
-                    capacity_ods.append(cap_ods)
-                    del cap_ods
-
-                    over_capacity_ods["residual_ratio"] = over_capacity_ods["residual_flows"]/over_capacity_ods[flow_column]
-                    over_capacity_ods.drop(["path_indexes",flow_column,"min_flows"],axis=1,inplace=True)
-                    over_capacity_ods.rename(columns={"residual_flows":flow_column},inplace=True)
-
-                    network_dataframe.drop("added_flow",axis=1,inplace=True)
-                    network_dataframe = update_flow_and_overcapacity(over_capacity_ods,
-                                                        network_dataframe,flow_column,subtract=True)
-                    network_dataframe.drop("added_flow",axis=1,inplace=True)
-                    flow_ods = over_capacity_ods[over_capacity_ods["residual_ratio"] > 0.01]
-                    flow_ods.drop(["edge_path","gcost","residual_ratio"],axis=1,inplace=True)
-                    del over_capacity_ods
-                else:
-                    if store_edge_path is False:
-                        flow_ods.drop("edge_path",axis=1,inplace=True)
-                    capacity_ods.append(flow_ods)
-                    network_dataframe.drop(["residual_capacity","added_flow"],axis=1,inplace=True)
-                    flow_ods = pd.DataFrame()
-
+        residual_capacity = edge_capacity - edge_flows
+        edge_weights = np.where(residual_capacity > 1e-3,edge_costs,np.inf)
+
+        if store_edge_path is False and len(capacity_ods) == 0:
+            constrained_edges = np.flatnonzero(np.isfinite(edge_weights) & (
+                                    residual_capacity - flow_ods[flow_column].sum() <= 1e-3))
+            od_costs = od_costs_and_edge_use(flow_ods,graph,edge_weights,constrained_edges)
+            if od_costs is not None:
+                gcost, uses_edges = od_costs
+                cost_ods = flow_ods[~uses_edges]
+                cost_ods["gcost"] = gcost[~uses_edges]
+                unassigned_paths.append(cost_ods[cost_ods["gcost"] == 0])
+                capacity_ods.append(cost_ods[cost_ods["gcost"] > 0])
+                del cost_ods
+                flow_ods = flow_ods[uses_edges]
+                if len(flow_ods.index) == 0:
+                    break
+
+        flow_ods, edge_paths = network_od_edge_index_paths(flow_ods,graph,edge_weights)
+        assigned = flow_ods["gcost"].values > 0
+        unassigned_paths.append(flow_ods[~assigned])
+        flow_ods = flow_ods[assigned].reset_index(drop=True)
+        edge_paths = [path for path,a in zip(edge_paths,assigned) if a]
+        if len(flow_ods.index) == 0:
+            break
+
+        path_offsets, path_edges = path_index_arrays(edge_paths)
+        path_flows = flow_ods[flow_column].values.astype(float)
+        added_flow = get_flow_on_path_edges(path_offsets,path_edges,path_flows,num_edges)
+        edge_flows += added_flow
+
+        over_capacity = ((edge_capacity - edge_flows) < -1.0e-3) & (added_flow > 0)
+        if over_capacity.any():
+            # Each path gets its share of the residual capacity of its most constrained edge
+            edge_ratios = np.full(num_edges,np.inf)
+            edge_ratios[over_capacity] = residual_capacity[over_capacity]/added_flow[over_capacity]
+            path_ratios = np.minimum.reduceat(edge_ratios[path_edges],path_offsets[:-1])
+            min_flows = np.where(np.isfinite(path_ratios),path_ratios*path_flows,path_flows)
+        else:
+            min_flows = path_flows
+
+        residual_flows = path_flows - min_flows
+        edge_flows -= get_flow_on_path_edges(path_offsets,path_edges,residual_flows,num_edges)
+
+        cap_ods = flow_ods.copy()
+        cap_ods[flow_column] = min_flows
+        if store_edge_path is True:
+            cap_ods.insert(len(cap_ods.columns) - 1,"edge_path",[edge_ids[path].tolist() for path in edge_paths])
+        capacity_ods.append(cap_ods)
+        del cap_ods
+
+        residual_ratios = residual_flows/path_flows
+        flow_ods = flow_ods[residual_ratios > 0.01]
+        flow_ods[flow_column] = residual_flows[residual_ratios > 0.01]
+        flow_ods.drop("gcost",axis=1,inplace=True)
+
+    node_names = node_index.values
+    capacity_ods = [ods.assign(origin_id=node_names[ods["origin_id"].values],
+                            destination_id=node_names[ods["destination_id"].values]) for ods in capacity_ods]
+    unassigned_paths = unassigned_paths[:1] + [ods.assign(origin_id=node_names[ods["origin_id"].values],
+                            destination_id=node_names[ods["destination_id"].values]) for ods in unassigned_paths[1:]]
     return capacity_ods, unassigned_paths
 
 def od_assignment_capacity_constrained_slow(od_dataframe,network_dataframe,
@@ -774,11 +1275,11 @@ def od_assignment_capacity_constrained_slow(od_dataframe,network_dataframe,
         a = min(tons,minimum_capacity)
         while a > 0:
             network_dataframe['over_cap'] = network_dataframe[flow_column] - network_dataframe[capacity_column]
-            graph = ig.Graph.TupleList(network_dataframe[network_dataframe['over_cap'] < 0].itertuples(index=False), 
-                                edge_attrs=list(network_dataframe[network_dataframe['over_cap'] < 0].columns)[2:])
-            graph_nodes = [x['name'] for x in graph.vs]
-            if (origin in graph_nodes) and (destination in graph_nodes): 
-                path = graph.get_shortest_paths(origin, [destination], weights=cost_column, output="epath")[0]
+            graph, node_index = network_graph_from_dataframe(network_dataframe[network_dataframe['over_cap'] < 0],
+                                edge_attributes=list(network_dataframe.columns)[2:])
+            if (origin in node_index) and (destination in node_index): 
+                path = graph.get_shortest_paths(node_index.get_loc(origin), [node_index.get_loc(destination)], 
+                                    weights=cost_column, output="epath")[0]
                 if path:
                     get_gcost = sum([x for x in graph.es[path][cost_column]])
                     get_path = [x for x in graph.es[path]['edge_id']]
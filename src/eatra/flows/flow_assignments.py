@@ -1,8 +1,12 @@
-"""Dissagregate OD matrix for air flows to node pairs
+"""Assign the OD flows of each epoch onto the multi-modal network with capacity constraints
 
+    The network is read once with the capacities of all the epochs
+    The epochs are assigned in a pool of worker processes and each writes its own outputs
 """
 import sys
 import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import pandas as pd
 import geopandas as gpd
@@ -20,7 +24,61 @@ from .analysis_utils import *
 from tqdm import tqdm
 tqdm.pandas()
 
-def main(config):
+# Inputs shared with the forked worker processes without copying
+assignment_inputs = None
+
+def assign_epoch_flows(results_data_path,f_idx,t_eph):
+    """Assign the OD flows of an epoch onto its network scenario and write the edge flows and flow paths
+    """
+    (ods_data_df,ods_values_columns,network_edges,
+        capacities,scenario_edges,baseline_od_year,gdp_growth_rate) = assignment_inputs
+    flow_column = "total_tonnage"
+    cost_column = "max_flow_cost"
+    assigned_output_path = os.path.join(results_data_path,"flow_paths",
+                    f"flow_paths_assigned_{t_eph}.parquet")
+    unassigned_output_path = os.path.join(results_data_path,"flow_paths",
+                    f"flow_paths_unassignment_{t_eph}.parquet")
+    edge_flows_path = os.path.join(results_data_path,"flow_paths",
+                    f"edge_flows_capacity_constrained_{t_eph}.csv")
+    
+    ods_df = ods_data_df.copy()
+    ods_df[ods_values_columns] = ((1+1.0*gdp_growth_rate/100.0)**(t_eph - baseline_od_year))*ods_df[ods_values_columns]
+    all_ods = ods_df[["origin_id","destination_id",flow_column]]
+
+    network_df = select_network_scenario(network_edges,capacities,scenario_edges,f_idx)
+    net_df = network_df.copy()
+    net_df[flow_column] = 0
+
+    capacity_ods,unassigned_paths = od_flow_allocation_capacity_constrained(all_ods,
+    										net_df,flow_column,cost_column)
+
+    if len(capacity_ods) > 0:
+        capacity_ods = pd.concat(capacity_ods,axis=0,ignore_index=True)
+        capacity_ods.rename(columns={flow_column:"assigned_tonnage"},inplace=True)
+        capacity_ods = pd.merge(capacity_ods,ods_df,how="left",on=["origin_id","destination_id"])
+        capacity_ods[ods_values_columns] = capacity_ods[ods_values_columns].multiply(
+                                            capacity_ods["assigned_tonnage"]/capacity_ods[flow_column],
+                                            axis="index")
+        capacity_ods.drop("assigned_tonnage",axis=1,inplace=True)
+
+        net_df = network_df.copy()
+        edge_flows = get_flow_on_edges(capacity_ods,"edge_id","edge_path",ods_values_columns)
+        net_df = pd.merge(net_df,edge_flows,how="left",on=["edge_id"]).fillna(0)
+        del edge_flows
+
+        net_df["over_capacity"] = net_df["capacity"] - net_df[flow_column]
+        net_df.to_csv(edge_flows_path,index=False)
+
+        write_flow_paths(capacity_ods,network_df["edge_id"].values,assigned_output_path)
+
+    if len(unassigned_paths) > 0:
+        unassigned_paths = pd.concat(unassigned_paths,axis=0,ignore_index=True)
+        unassigned_paths.to_parquet(unassigned_output_path,index=False)
+
+    return t_eph
+
+def main(config,num_workers=None):
+    global assignment_inputs
     incoming_data_path = config['paths']['incoming_data']
     processed_data_path = config['paths']['data']
     results_data_path = config['paths']['results']
@@ -33,76 +91,40 @@ def main(config):
     baseline_od_year = 2015
     gdp_growth_rate = 5  # 5% growth rate assumed for the EAC region
 
-    flow_column = "total_tonnage"
-    cost_column = "max_flow_cost"
     od_columns = ["origin_id","destination_id"]
     ods_data_df = pd.read_csv(os.path.join(results_data_path,
                                         "flow_paths",
                                         "od_matrix_nodes_unique_pairs.csv"))
     ods_values_columns = [c for c in ods_data_df.columns.values.tolist() if c not in od_columns] 
     flow_combinations = list(zip(time_epochs,road_capacity_factors,rail_capacity_factors))
-    for f_idx,(t_eph,road_cf,rail_cf) in enumerate(flow_combinations):   
-        # assigned_output_path = os.path.join(results_data_path,"flow_paths",
-        #                 f"flow_paths_assigned_{t_eph}.csv")
-        # unassigned_output_path = os.path.join(results_data_path,"flow_paths",
-        #                 f"flow_paths_unassignment_{t_eph}.csv")
-        assigned_output_path = os.path.join(results_data_path,"flow_paths",
-                        f"flow_paths_assigned_{t_eph}.parquet")
-        unassigned_output_path = os.path.join(results_data_path,"flow_paths",
-                        f"flow_paths_unassignment_{t_eph}.parquet")
-        edge_flows_path = os.path.join(results_data_path,"flow_paths",
-                        f"edge_flows_capacity_constrained_{t_eph}.csv")
-        
-        ods_df = ods_data_df.copy()
-        ods_df[ods_values_columns] = ((1+1.0*gdp_growth_rate/100.0)**(t_eph - baseline_od_year))*ods_df[ods_values_columns]
-        all_ods = ods_df[["origin_id","destination_id",flow_column]]
+    network_scenarios = []
+    for t_eph,road_cf,rail_cf in flow_combinations:
         if t_eph == time_epochs[0]:
             rail_status = ["open"]
         else:
             rail_status = ["open","proposed","rehabilitation","construction"]
+        network_scenarios.append({"rail_status":rail_status,
+                                "road_future_usage":road_cf,
+                                "rail_future_usage":rail_cf})
 
-        network_df = create_multi_modal_network_africa(rail_status=rail_status,
-                                                    road_future_usage=road_cf,
-                                                    rail_future_usage=rail_cf,
-                                                    return_network=False)
-        net_df = network_df.copy()
-        net_df[flow_column] = 0
-
-        capacity_ods,unassigned_paths = od_flow_allocation_capacity_constrained(all_ods,
-        										net_df,flow_column,cost_column)
-
-        if len(capacity_ods) > 0:
-            capacity_ods = pd.concat(capacity_ods,axis=0,ignore_index=True)
-            capacity_ods.rename(columns={flow_column:"assigned_tonnage"},inplace=True)
-            capacity_ods = pd.merge(capacity_ods,ods_df,how="left",on=["origin_id","destination_id"])
-            capacity_ods[ods_values_columns] = capacity_ods[ods_values_columns].multiply(
-                                                capacity_ods["assigned_tonnage"]/capacity_ods[flow_column],
-                                                axis="index")
-            capacity_ods.drop("assigned_tonnage",axis=1,inplace=True)
-            # print (capacity_ods)
-
-            net_df = network_df.copy()
-            for c in ods_values_columns:
-                edge_flows = get_flow_on_edges(capacity_ods,"edge_id","edge_path",c)
-                net_df = pd.merge(net_df,edge_flows,how="left",on=["edge_id"]).fillna(0)
-                del edge_flows
-
-            net_df["over_capacity"] = net_df["capacity"] - net_df[flow_column]
-            net_df.to_csv(edge_flows_path,index=False)
-
-            capacity_ods["edge_path"] = capacity_ods["edge_path"].astype(str)
-            vc = [c for c in capacity_ods.columns.values.tolist() if c not in ["origin_id","destination_id","edge_path"]]
-            capacity_ods.groupby(["origin_id","destination_id","edge_path"])[vc].sum().reset_index()
-            # capacity_ods.to_csv(assigned_output_path,index=False)
-            capacity_ods.to_parquet(assigned_output_path,index=False)
-
-
-        if len(unassigned_paths) > 0:
-            unassigned_paths = pd.concat(unassigned_paths,axis=0,ignore_index=True)
-            # unassigned_paths.to_csv(unassigned_output_path,index=False)
-            unassigned_paths.to_parquet(unassigned_output_path,index=False)
-            # print (unassigned_paths)
+    # The network is read once, with the capacities and edges of every epoch as columns of arrays
+    network_edges,capacities,scenario_edges = create_multi_modal_network_africa_scenarios(network_scenarios)
+    assignment_inputs = (ods_data_df,ods_values_columns,network_edges,
+                        capacities,scenario_edges,baseline_od_year,gdp_growth_rate)
+
+    if num_workers is None:
+        num_workers = min(len(flow_combinations),os.cpu_count())
+    with ProcessPoolExecutor(max_workers=num_workers,
+                            mp_context=multiprocessing.get_context("fork")) as executor:
+        epoch_runs = [executor.submit(assign_epoch_flows,results_data_path,f_idx,t_eph) 
+                        for f_idx,(t_eph,road_cf,rail_cf) in enumerate(flow_combinations)]
+        for epoch_run in as_completed(epoch_runs):
+            print (f"* Done with {epoch_run.result()}")
+    assignment_inputs = None
 
 if __name__ == '__main__':
     CONFIG = load_config()
-    main(CONFIG)
\ No newline at end of file
+    if len(sys.argv) > 1:
+        main(CONFIG,num_workers=int(sys.argv[1]))
+    else:
+        main(CONFIG)
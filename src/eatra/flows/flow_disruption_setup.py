@@ -6,7 +6,7 @@
     The script first reads in the edges data for a particular network 
         And then divides the numbers of edges into paritions which will be selected as initiating failure scenarios
         
-        Example output - 2019,'/.../path_to_files/',0,90
+        Example partition - 2019,'/.../path_to_files/',0,90
         - Network scenarios - year
         - Number of failure scenario - 1
         - First edge to sample for initiating failure - The one at location 0 on the edge list
@@ -14,10 +14,7 @@
         
         We are mainly selecting the first 91 edges of the flooded road + rail network one-by-one and failing them
         
-        All partitions are writtening into text files named as parallel_network_scenario_dependency.txt 
-        Example: partitions_2019.txt
-
-        Example output in file: parallel_2019.txt
+        Example partitions of a year:
             2019,'../../flow_disruptions/2019',0,90
             2019,'../../flow_disruptions/2019',90,181
             2019,'../../flow_disruptions/2019',181,272
@@ -26,17 +23,29 @@
             2019,'../../flow_disruptions/2019',453,544
             2019,'../../flow_disruptions/2019',544,635
         
-        Each of these lines is a batch of scnearios that are run on different processors in parallel
+        Each of these partitions is a batch of scenarios that is run in a pool of worker processes
+        The network and flow paths of a year are read once and shared with the workers
+        Each batch writes its losses to its own file as soon as it is done, and finished batches are skipped on a rerun
 """
 import os
 import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
 from .analysis_utils import *
+from .flow_disruptions import load_flow_disruption_inputs, run_failure_scenarios
 from tqdm import tqdm
-import subprocess 
 
 tqdm.pandas()
+
+# Inputs of the year being processed, shared with the forked worker processes without copying
+disruption_inputs = None
+
+def run_failure_batch(failure_results,min_node_number,max_node_number):
+    return run_failure_scenarios(disruption_inputs,failure_results,min_node_number,max_node_number)
+
 def main(config):
+    global disruption_inputs
     results_data_path = config['paths']['results']
     failure_results = os.path.join(results_data_path,"flow_disruptions")
     if os.path.exists(failure_results) == False:
@@ -46,8 +55,8 @@ def main(config):
     """
     damages_results_path = os.path.join(results_data_path,"risk_results_original","direct_damages_summary")
 
-    rail_failure_edges = pd.read_csv(os.path.join(damages_results_path,"rail_edges_damages.csv"))
-    road_failure_edges = pd.read_csv(os.path.join(damages_results_path,"road_edges_damages.csv"))
+    rail_failure_edges = pd.read_parquet(os.path.join(damages_results_path,"rail_edges_damages.parquet"),columns=["edge_id"])
+    road_failure_edges = pd.read_parquet(os.path.join(damages_results_path,"road_edges_damages.parquet"),columns=["edge_id"])
 
     all_failures = rail_failure_edges["edge_id"].values.tolist() + road_failure_edges["edge_id"].values.tolist()
 
@@ -57,35 +66,27 @@ def main(config):
     # scenarios = [2030,2050,2080]
     for sc in scenarios:  
         loss_files = []  
-        run_results = False
+        failure_batches = []
         num_values = np.linspace(0,len(all_failures)-1,num_partitions)
         fp = os.path.join(failure_results,str(sc))
         if os.path.exists(fp) == False:
             os.mkdir(fp)
-        with open(f"parallel_{sc}.txt","w+") as f:
-            for n in range(len(num_values)-1): 
-                min_value = int(num_values[n])
-                max_value = int(min(num_values[n+1],len(all_failures))) 
-                if os.path.exists(os.path.join(fp,f"flow_disruption_losses_{min_value}_{max_value}.csv")) is False:
-                    f.write(f'{sc},{fp},{min_value},{max_value}\n')   
-                    run_results = True    
-                else:
-                    loss_files.append(os.path.join(fp,f"flow_disruption_losses_{min_value}_{max_value}.csv"))
+        for n in range(len(num_values)-1): 
+            min_value = int(num_values[n])
+            max_value = int(min(num_values[n+1],len(all_failures))) 
+            loss_files.append(os.path.join(fp,f"flow_disruption_losses_{min_value}_{max_value}.csv"))
+            if os.path.exists(loss_files[-1]) is False:
+                failure_batches.append((min_value,max_value))
 
-        f.close()
-        
-        if run_results is True:
-            args = ["parallel",
-                    "-j", str(num_blocks),
-                    "--colsep", ",",
-                    "-a",
-                    f"parallel_{sc}.txt",
-                    "python",
-                    "flow_disruptions.py",
-                    "{}"
-                    ]
-            print (args)
-            subprocess.run(args)
+        if len(failure_batches) > 0:
+            disruption_inputs = load_flow_disruption_inputs(config,sc)
+            with ProcessPoolExecutor(max_workers=num_blocks,
+                                    mp_context=multiprocessing.get_context("fork")) as executor:
+                batch_runs = [executor.submit(run_failure_batch,fp,min_value,max_value) 
+                                for min_value,max_value in failure_batches]
+                for batch_run in as_completed(batch_runs):
+                    print (f"* Done with {batch_run.result()}")
+            disruption_inputs = None
 
         loss_df = pd.concat([pd.read_csv(lf) for lf in loss_files],axis=0,ignore_index=True)
         num = loss_df._get_numeric_data()
@@ -21,19 +21,23 @@ from tqdm import tqdm
 tqdm.pandas()
 
 def flow_disruption_estimation(network_dataframe, edge_failure_set,
-    flow_dataframe,edge_flow_path_indexes,edge_id_column,flow_column,cost_column):
+    flow_dataframe,path_offsets,path_edges,edge_offsets,edge_paths,
+    edge_id_column,flow_column,cost_column):
     """Estimate network impacts of each failures
     When the tariff costs of each path are fixed by vehicle weight
 
     Parameters
     ---------
-    network_df_in - Pandas DataFrame of network
+    network_dataframe - Pandas DataFrame of network
     edge_failure_set - List of string edge ID's
-    flow_dataframe - Pandas DataFrame of list of edge paths
-    path_column - String name of column of edge paths in flow dataframe
-    tons_column - String name of column of path tons in flow dataframe
+    flow_dataframe - Pandas DataFrame of OD flows
+    path_offsets - Start positions of the path of each OD flow in path_edges
+    path_edges - Integer indexes of the rows of network_dataframe along the paths of all OD flows
+    edge_offsets - Start positions of the paths of each row of network_dataframe in edge_paths
+    edge_paths - Integer indexes of the OD flows passing through each row of network_dataframe
+    edge_id_column - String name of column of edge IDs in network dataframe
+    flow_column - String name of column of path tons in flow dataframe
     cost_column - String name of column of path costs in flow dataframe
-    time_column - String name of column of path travel time in flow dataframe
 
 
     Returns
@@ -49,51 +53,62 @@ def flow_disruption_estimation(network_dataframe, edge_failure_set,
         new_path - List of string edge ID's of estimated new route of OD journey after disruption
         new_time - Float value of estimated time of OD journey after disruption
     """
-    edge_path_index = get_path_indexes_for_edges(edge_flow_path_indexes,edge_failure_set)
-    select_flows = flow_dataframe[flow_dataframe.index.isin(edge_path_index)]
+    failed_edges = network_dataframe[edge_id_column].isin(edge_failure_set).values
+    edge_path_index = get_path_indexes_for_edges(edge_offsets,edge_paths,np.flatnonzero(failed_edges))
+    select_flows = flow_dataframe.iloc[edge_path_index]
+    select_offsets, select_edges = select_path_arrays(path_offsets,path_edges,edge_path_index)
     del edge_path_index
 
     """Find the flows in the disrupted edges 
     """
-    affected_flows = get_flow_on_edges(select_flows,edge_id_column,"edge_path",flow_column)
-    affected_flows.rename(columns={flow_column:"affected_flows"},inplace=True)
-    # print (affected_flows)
+    affected_flows = get_flow_on_path_edges(select_offsets,select_edges,
+                            select_flows[flow_column].values,len(network_dataframe.index))
     network_df_in = network_dataframe.copy()
-    network_df_in = pd.merge(network_df_in,affected_flows,how='left',on=[edge_id_column])
-    network_df_in['affected_flows'].fillna(0,inplace=True)
-    network_df_in[flow_column] = network_df_in[flow_column] - network_df_in['affected_flows']
-    network_df_in.drop('affected_flows',axis=1,inplace=True)
-    del affected_flows
+    network_df_in[flow_column] = network_df_in[flow_column] - affected_flows
+    del affected_flows, select_offsets, select_edges
 
     affected_flows =  select_flows.copy()
-    affected_flows.drop("edge_path",axis=1,inplace=True)
     affected_flows.rename(columns={"gcost":"old_cost"},inplace=True)
     reassinged_flows, no_flows = od_flow_allocation_capacity_constrained(affected_flows,
-                                    network_df_in[~network_df_in[edge_id_column].isin(edge_failure_set)],
+                                    network_df_in[~failed_edges],
                                     flow_column,cost_column,store_edge_path=False)
     del network_df_in, affected_flows
     
     return reassinged_flows, no_flows
 
-def main(config,year,failure_results,min_node_number,max_node_number):
-    incoming_data_path = config['paths']['incoming_data']
-    processed_data_path = config['paths']['data']
+def load_flow_disruption_inputs(config,year):
+    """Read the network, the assigned flow paths and the failure scenarios of a year
+
+    The inputs are read once and can be shared by all the failure scenarios of the year
+
+    Returns
+    -------
+    inputs : dict
+        - network - Pandas DataFrame of network edges and their flows
+        - flows - Pandas DataFrame of assigned OD flows
+        - path_offsets, path_edges - Paths of the OD flows along the rows of the network dataframe
+        - edge_offsets, edge_paths - Index of the OD flows passing through each row of the network dataframe
+        - failures - List of edge IDs of the failure scenarios
+    """
     results_data_path = config['paths']['results']
 
-    flow_column = "total_tonnage"
-    flow_value_usd = "total_value_usd"
-    cost_column = "max_flow_cost"
-    od_columns = ["origin_id","destination_id","edge_path","gcost"]
     od_flows_file = os.path.join(results_data_path,"flow_paths",
                     f"flow_paths_assigned_{year}.parquet")
     edge_flows_file = os.path.join(results_data_path,"flow_paths",
                     f"edge_flows_capacity_constrained_{year}.csv")
     
-    flow_df = pd.read_parquet(od_flows_file)
-    flow_df['edge_path'] = flow_df.progress_apply(lambda x:ast.literal_eval(x['edge_path']),axis=1)
+    flow_df, path_offsets, path_edges, edge_ids = read_flow_paths(od_flows_file)
+    if os.path.isfile(get_flow_paths_edge_index_file(od_flows_file)) is True:
+        edge_offsets, edge_paths = read_edge_path_index(od_flows_file)
+    else:
+        edge_offsets, edge_paths = build_edge_path_index(path_offsets,path_edges,len(edge_ids))
     network_df = pd.read_csv(edge_flows_file)
-    ods_values_columns = [c for c in flow_df.columns.values.tolist() if c not in od_columns] 
-    edge_path_idx = get_flow_paths_indexes_of_edges(flow_df,'edge_path')
+    # Point the paths and the edge path index to the rows of the network dataframe
+    # Network edges missing from the flow paths point to an empty row added at the end of the index
+    path_edges = pd.Index(network_df["edge_id"].values).get_indexer(edge_ids)[path_edges]
+    edge_offsets, edge_paths = select_path_arrays(np.append(edge_offsets,edge_offsets[-1]),
+                                        edge_paths,
+                                        pd.Index(edge_ids).get_indexer(network_df["edge_id"].values))
     
     # Perform failure analysis
     # Generate a failure sample. We will update this later
@@ -101,11 +116,38 @@ def main(config,year,failure_results,min_node_number,max_node_number):
     # Get the list of nodes of the initiating sector to fail
     damages_results_path = os.path.join(results_data_path,"risk_results_original","direct_damages_summary")
 
-    rail_failure_edges = pd.read_csv(os.path.join(damages_results_path,"rail_edges_damages.csv"))
-    road_failure_edges = pd.read_csv(os.path.join(damages_results_path,"road_edges_damages.csv"))
+    rail_failure_edges = pd.read_parquet(os.path.join(damages_results_path,"rail_edges_damages.parquet"),columns=["edge_id"])
+    road_failure_edges = pd.read_parquet(os.path.join(damages_results_path,"road_edges_damages.parquet"),columns=["edge_id"])
 
     all_failures = rail_failure_edges["edge_id"].values.tolist() + road_failure_edges["edge_id"].values.tolist()
-    
+
+    return {
+            "network":network_df,
+            "flows":flow_df,
+            "path_offsets":path_offsets,
+            "path_edges":path_edges,
+            "edge_offsets":edge_offsets,
+            "edge_paths":edge_paths,
+            "failures":all_failures
+            }
+
+def run_failure_scenarios(inputs,failure_results,min_node_number,max_node_number,
+        flow_column="total_tonnage",flow_value_usd="total_value_usd",cost_column="max_flow_cost"):
+    """Estimate the economic losses of a batch of failure scenarios and write them to a CSV file
+
+    Parameters
+    ---------
+    inputs - Dictionary of inputs created by load_flow_disruption_inputs
+    failure_results - Path of the folder to write the losses to
+    min_node_number - Index of the first failure scenario of the batch
+    max_node_number - Index after the last failure scenario of the batch
+
+    Returns
+    -------
+    String path of the losses file, or None if there are no scenarios in the batch
+    """
+    network_df = inputs["network"]
+    all_failures = inputs["failures"]
     if max_node_number > len(all_failures):
         max_node_number = len(all_failures)
     #  Start the failure simiulations by looping over each failure scenario corresponding to an inidviual failed edge
@@ -118,7 +160,8 @@ def main(config,year,failure_results,min_node_number,max_node_number):
 
             if network_df[network_df["edge_id"].isin(fail_edges)][flow_column].sum() > 0: 
                 rerouted_flows, isolated_flows = flow_disruption_estimation(network_df,fail_edges,
-                                                    flow_df,edge_path_idx,"edge_id",flow_column,
+                                                    inputs["flows"],inputs["path_offsets"],inputs["path_edges"],
+                                                    inputs["edge_offsets"],inputs["edge_paths"],"edge_id",flow_column,
                                                     cost_column)
 
                 rerouting_loss = 0
@@ -146,8 +189,16 @@ def main(config,year,failure_results,min_node_number,max_node_number):
             print (f"* Done with failure scenario {fail_edges}")
 
         ef_list = pd.DataFrame(ef_list,columns=["edge_id","rerouting_loss","isolation_loss","economic_loss"])
-        ef_list.to_csv(os.path.join(failure_results,
-                        f"flow_disruption_losses_{min_node_number}_{max_node_number}.csv"),index=False)
+        loss_file = os.path.join(failure_results,
+                        f"flow_disruption_losses_{min_node_number}_{max_node_number}.csv")
+        ef_list.to_csv(loss_file,index=False)
+        return loss_file
+
+    return None
+
+def main(config,year,failure_results,min_node_number,max_node_number):
+    inputs = load_flow_disruption_inputs(config,year)
+    run_failure_scenarios(inputs,failure_results,min_node_number,max_node_number)
 
 if __name__ == "__main__":
     CONFIG = load_config()
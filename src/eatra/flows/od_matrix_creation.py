@@ -70,14 +70,46 @@ def partition_import_export_flows_to_nodes(trade_node_od,node_dataframe,flow_dat
     return trade_node_od
 
 def route_roads_to_nearest_ports(origins_destinations,network_graph,sort_by="origin_id",cost_function="max_flow_cost"):
-    # network_graph = create_multi_modal_network_africa(modes=["road","multi"])
-    # destinations = list(set(destinations["node_id"].values.tolist()))
-    # origins = list(set(origins["node_id"].values.tolist()))
-    flow_paths = network_od_paths_assembly(origins_destinations,
-                                network_graph,
-                                cost_function)
-    flow_paths = flow_paths.sort_values(by="gcost")
-    flow_paths = flow_paths.drop_duplicates(subset=[sort_by],keep="first")
+    """Find the least cost gateway of each node
+
+    One Graph.distances call between the gateways and all the nodes gives the costs of all OD pairs,
+    without building the paths of the OD pairs
+
+    Parameters
+    ----------
+    origins_destinations - Pandas DataFrame of origin_id and destination_id pairs
+    network_graph - igraph network
+    sort_by - String name of the column of the nodes to find gateways for,
+            the other column has the gateways
+    cost_function - String name of the edge cost attribute of the network
+
+    Returns
+    -------
+    Pandas DataFrame of origin_id, destination_id and gcost, with the least cost pair of each node
+        Nodes that cannot reach any gateway keep one of their pairs with a 0 gcost
+    """
+    gateway_column = "destination_id" if sort_by == "origin_id" else "origin_id"
+    vertex_index = pd.Index(network_graph.vs["name"])
+    gateways, gateway_index = np.unique(origins_destinations[gateway_column].values,return_inverse=True)
+    nodes, node_index = np.unique(origins_destinations[sort_by].values,return_inverse=True)
+    gateway_vertices = vertex_index.get_indexer(gateways)
+    node_vertices = vertex_index.get_indexer(nodes)
+
+    costs = np.full((len(gateways),len(nodes)),np.inf)
+    gateway_found = np.flatnonzero(gateway_vertices >= 0)
+    node_found = np.flatnonzero(node_vertices >= 0)
+    if len(gateway_found) > 0 and len(node_found) > 0:
+        costs[np.ix_(gateway_found,node_found)] = network_graph.distances(
+                                                    source=gateway_vertices[gateway_found].tolist(),
+                                                    target=node_vertices[node_found].tolist(),
+                                                    weights=cost_function,
+                                                    mode="out" if gateway_column == "origin_id" else "in")
+    gcost = costs[gateway_index,node_index]
+    # The first pair of each node after sorting by cost is its least cost pair
+    nearest = np.lexsort((gcost,node_index))
+    nearest = nearest[np.r_[True,node_index[nearest][1:] != node_index[nearest][:-1]]]
+    flow_paths = origins_destinations[["origin_id","destination_id"]].iloc[nearest].reset_index(drop=True)
+    flow_paths["gcost"] = np.where(np.isfinite(gcost[nearest]),gcost[nearest],0)
 
     return flow_paths
 
@@ -132,6 +164,65 @@ def make_od_pairs(od_nodes,
 
     return pd.concat([od_nodes_sector_countries,od_nodes_rest],axis=0,ignore_index=True)
 
+def country_node_weights(country_nodes,node_weights,iso_code,weight_column,country_limit=None):
+    """Node IDs and normalised weights of the road nodes of a country
+
+    The results are kept in node_weights, so the nodes of each country 
+    are only sorted and normalised once for each weight column
+
+    Parameters
+    ----------
+    country_nodes - Dictionary of Pandas DataFrames of road nodes of each country
+    node_weights - Dictionary of results of earlier calls
+    iso_code - String ISO code of the country
+    weight_column - String name of the column of node weights
+    country_limit - Number of nodes with the highest weights to keep, all nodes are kept if None
+
+    Returns
+    -------
+    node_ids - Numpy array of the IDs of the nodes with positive weights
+    weights - Numpy array of the weights of the nodes, adding up to 1
+    """
+    key = (iso_code,weight_column,country_limit)
+    if key not in node_weights:
+        node_ids = np.array([],dtype=object)
+        weights = np.array([],dtype=float)
+        nodes = country_nodes.get(iso_code)
+        if nodes is not None:
+            if country_limit is not None:
+                nodes = nodes.sort_values(by=weight_column,ascending=False).head(country_limit)
+            # Missing weights are skipped, as in the pandas sum
+            weights = nodes[weight_column].fillna(0).to_numpy(dtype=float)
+            if weights.sum() > 0:
+                node_ids = nodes["node_id"].values[weights > 0]
+                weights = weights[weights > 0]/weights.sum()
+            else:
+                weights = np.array([],dtype=float)
+        node_weights[key] = (node_ids,weights)
+
+    return node_weights[key]
+
+def disaggregate_od_flows(origin_ids,origin_weights,
+                        destination_ids,destination_weights,
+                        tonnage,value_usd,tonnage_threshold=0):
+    """Daily tonnages and values of all pairs of origin and destination nodes of a yearly country OD flow
+
+    The flows of the node pairs are the outer products of the origin and destination weights
+    
+    Returns
+    -------
+    Pandas DataFrame of origin_id, destination_id, tonnage and value_usd
+        of the node pairs with tonnages above the threshold
+    """
+    from_tonnage = (1.0*tonnage/365.0)*origin_weights
+    from_value = (1.0*value_usd/365.0)*origin_weights
+    tonnages = np.outer(from_tonnage,destination_weights)
+    origins, destinations = np.nonzero(tonnages >= tonnage_threshold)
+    return pd.DataFrame({"origin_id":origin_ids[origins],
+                        "destination_id":destination_ids[destinations],
+                        "tonnage":tonnages[origins,destinations],
+                        "value_usd":from_value[origins]*destination_weights[destinations]})
+
 def transform_rows_to_columns(dataframe,index_columns,pivot_column,value_column,pivot_values):
     df = (dataframe.set_index(index_columns).pivot(
                                     columns=pivot_column
@@ -261,14 +352,12 @@ def main(config):
                             )
                         ]["node_id"].values.tolist()))
         roads = list(set(road_nodes[road_nodes["iso_code"] == hvt]["node_id"].values.tolist()))
-        roads_routes = [list(zip([b]*len(roads),roads)) for b in ports]
-        roads_routes = [item for sublist in roads_routes for item in sublist]
-        roads_routes = pd.DataFrame(roads_routes,columns=["origin_id","destination_id"])
+        roads_routes = pd.DataFrame({"origin_id":np.repeat(np.array(ports,dtype=object),len(roads)),
+                                    "destination_id":np.tile(np.array(roads,dtype=object),len(ports))})
         # print (roads_routes)
         if (hvt,mode) in countries_port_partitions:
             roads_routes = route_roads_to_nearest_ports(roads_routes,network_graph,
                                                     sort_by="destination_id")
-            roads_routes.drop("edge_path",axis=1,inplace=True)
         # else:
         #   roads_routes = network_od_paths_assembly(roads_routes,
         #                         network_graph,
@@ -356,74 +445,66 @@ def main(config):
                                     default_export_columns
                                 )
                             )
-    road_node_od_pairs = []
+    od_columns = ["origin_id","destination_id","iso3_O","iso3_D","sector","tonnage","value_usd"]
+    od_schema = pa.schema([(c,pa.string()) for c in od_columns[:5]] + [(c,pa.float64()) for c in od_columns[5:]])
+    hvt_edges = set(hvt_network["edge_id"].values.tolist())
+    # Group the road nodes by country once, and keep the weights of each country as they are found
+    country_nodes = dict(list(road_nodes.groupby("iso_code")))
+    node_weights = {}
+    # The road OD pairs of each country pair are streamed to a parquet file
+    road_od_file = os.path.join(results_data_path,"flow_paths","road_node_od_pairs.parquet")
+    if os.path.isfile(road_od_file) is True:
+        os.remove(road_od_file)
+    od_writer = None
     # land_ods = land_ods[land_ods["iso3_O"].isin(["TZA"])]
     for i, (s,iwc,ewc,dic,dec) in enumerate(column_combinations):
         road_ods = land_ods[land_ods["sector"] == s]
         for row in road_ods.itertuples():
-            origins = road_nodes[road_nodes["iso_code"] == row.iso3_O]
-            origins.rename(columns={"node_id":"origin_id","iso_code":"iso3_O"},inplace=True)
-            origins["sector"] = s
-            weight_column = ewc
-            if row.iso3_O not in sector_countries:
-                weight_column = dec
-                origins = origins.sort_values(by=weight_column,ascending=False).head(country_limit)
+            if row.iso3_O in sector_countries:
+                origin_ids, origin_weights = country_node_weights(country_nodes,node_weights,row.iso3_O,ewc)
+            else:
+                origin_ids, origin_weights = country_node_weights(country_nodes,node_weights,row.iso3_O,dec,
+                                                                country_limit=country_limit)
+            if row.iso3_D in sector_countries:
+                destination_ids, destination_weights = country_node_weights(country_nodes,node_weights,row.iso3_D,iwc)
+            else:
+                destination_ids, destination_weights = country_node_weights(country_nodes,node_weights,row.iso3_D,dic,
+                                                                country_limit=country_limit)
             
-            if origins[weight_column].sum() > 0:
-                origins["from_tonnage"] = (1.0*row.tonnage/365.0)*origins[weight_column]/origins[weight_column].sum()
-                origins["from_value"] = (1.0*row.value_usd/365.0)*origins[weight_column]/origins[weight_column].sum()
-
-                destinations = road_nodes[road_nodes["iso_code"] == row.iso3_D]
-                destinations.rename(columns={"node_id":"destination_id","iso_code":"iso3_D"},inplace=True)
-                weight_column = iwc
-                if row.iso3_D not in sector_countries:
-                    weight_column = dic
-                    destinations = destinations.sort_values(by=weight_column,ascending=False).head(country_limit)
-
-                if destinations[weight_column].sum():
-                    destinations["weight"] = destinations[weight_column]/destinations[weight_column].sum()
-                    origins = origins[origins["from_tonnage"] > 0][["origin_id","iso3_O","sector","from_tonnage","from_value"]]
-                    destinations = destinations[destinations["weight"] > 0][["destination_id","iso3_D","weight"]]
-                    if len(origins.index) > 0 and len(destinations.index) > 0:
-                        ods = (origins.assign(dummy=1).merge(destinations.assign(dummy=1), on='dummy').drop('dummy', axis=1))
-                        ods = ods[["origin_id","destination_id",
-                        			"iso3_O","iso3_D","sector",
-                        			"from_tonnage","from_value","weight"]]
-                        ods[["tonnage","value_usd"]] = ods[["from_tonnage","from_value"]].multiply(ods["weight"],axis="index")
-                        ods = ods[ods["tonnage"] >= tonnage_threshold]
-                        if len(ods.index) > 0:
-                            if len(origins.index) <= len(destinations.index):
-                            	ods = network_od_paths_assembly(ods,network_graph,"max_flow_cost")
-                            else:
-                            	od_cols = ods.columns.values.tolist()
-                            	ods.columns = ["destination_id","origin_id"] + od_cols[2:]
-                            	ods = network_od_paths_assembly(ods,network_graph,"max_flow_cost")
-                            	od_cols = ods.columns.values.tolist()
-                            	ods.columns = ["destination_id","origin_id"] + od_cols[2:]
-
-                            ods["hvt_pass"] = ods.apply(
-                                                    lambda x:len(
-                                                                hvt_network[
-                                                                        hvt_network["edge_id"].isin(x.edge_path)
-                                                                        ].index
-                                                                ),axis=1)
-                            # ods = pd.merge(ods,ods_paths,how="left",on=["origin_id","destination_id"])
-                            # print (ods)
-                            # del ods_paths
-                            road_node_od_pairs.append(ods[ods["hvt_pass"] > 0][["origin_id",
-                                                            "destination_id",
-                                                            "iso3_O","iso3_D",
-                                                            "sector",
-                                                            "tonnage","value_usd"]])
-                            del ods
+            if len(origin_ids) > 0 and len(destination_ids) > 0:
+                ods = disaggregate_od_flows(origin_ids,origin_weights,
+                                        destination_ids,destination_weights,
+                                        row.tonnage,row.value_usd,
+                                        tonnage_threshold=tonnage_threshold)
+                if len(ods.index) > 0:
+                    ods["iso3_O"] = row.iso3_O
+                    ods["iso3_D"] = row.iso3_D
+                    ods["sector"] = s
+                    ods = ods[od_columns]
+                    if len(origin_ids) <= len(destination_ids):
+                    	ods = network_od_paths_assembly(ods,network_graph,"max_flow_cost")
+                    else:
+                    	od_cols = ods.columns.values.tolist()
+                    	ods.columns = ["destination_id","origin_id"] + od_cols[2:]
+                    	ods = network_od_paths_assembly(ods,network_graph,"max_flow_cost")
+                    	od_cols = ods.columns.values.tolist()
+                    	ods.columns = ["destination_id","origin_id"] + od_cols[2:]
+
+                    ods["hvt_pass"] = [len(hvt_edges.intersection(path)) if isinstance(path,list) else 0 for path in ods["edge_path"].values]
+                    ods = ods[ods["hvt_pass"] > 0][od_columns]
+                    if len(ods.index) > 0:
+                        if od_writer is None:
+                            od_writer = pq.ParquetWriter(road_od_file,od_schema)
+                        od_writer.write_table(pa.Table.from_pandas(ods,schema=od_schema,preserve_index=False))
+                    del ods
 
             print (f"* Done with {row.iso3_O}-{row.iso3_D} for sector {s}")
 
-    # road_node_od_pairs = pd.DataFrame(road_node_od_pairs,
-    #                             columns=["origin_id",
-    #                             "destination_id",
-    #                             "iso3_O","iso3_D","tonnage","value_usd"])
-    road_node_od_pairs = pd.concat(road_node_od_pairs,axis=0,ignore_index=True)
+    if od_writer is not None:
+        od_writer.close()
+        road_node_od_pairs = pd.read_parquet(road_od_file)
+    else:
+        road_node_od_pairs = pd.DataFrame(columns=od_columns)
     road_node_od_pairs = road_node_od_pairs.groupby(["origin_id",
                                                     "destination_id",
                                                     "iso3_O",
@@ -7,6 +7,8 @@ import sys
 import warnings
 
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 import fiona
 import geopandas
@@ -14,6 +16,7 @@ import numpy
 import pandas
 import rasterio
 
+from rasterio.windows import Window
 from shapely.geometry import mapping, shape
 from shapely.ops import linemerge, polygonize
 from snail.core.intersections import get_cell_indices, split_linestring, split_polygon
@@ -28,7 +31,7 @@ def load_config():
     return config
 
 
-def main(data_path, networks_csv, hazards_csv,output_path):
+def main(data_path, networks_csv, hazards_csv, output_path, num_workers=1):
     # read transforms, record with hazards
     hazards = pandas.read_csv(hazards_csv)
     hazard_slug = os.path.basename(hazards_csv).replace(".csv", "")
@@ -65,7 +68,7 @@ def main(data_path, networks_csv, hazards_csv,output_path):
                 # look up nodes cell index
                 nodes = geopandas.read_file(fname, layer="nodes")
                 logging.info("Node CRS %s", nodes.crs)
-                nodes = process_nodes(nodes, transforms, hazard_transforms, data_path)
+                nodes = process_nodes(nodes, transforms, hazard_transforms, data_path, num_workers)
                 # nodes.to_file(out_fname, driver="GPKG", layer="nodes")
                 nodes.to_parquet(pq_fname_nodes)
 
@@ -77,7 +80,7 @@ def main(data_path, networks_csv, hazards_csv,output_path):
                 # split lines
                 edges = geopandas.read_file(fname, layer="edges")
                 logging.info("Edge CRS %s", edges.crs)
-                edges = process_edges(edges, transforms, hazard_transforms, data_path)
+                edges = process_edges(edges, transforms, hazard_transforms, data_path, num_workers)
                 # edges.to_file(out_fname, driver="GPKG", layer="edges")
                 edges.to_parquet(pq_fname_edges)
 
@@ -90,7 +93,7 @@ def main(data_path, networks_csv, hazards_csv,output_path):
                 areas = geopandas.read_file(fname, layer="areas")
                 logging.info("Area CRS %s", areas.crs)
                 areas = explode_multi(areas)
-                areas = process_areas(areas, transforms, hazard_transforms, data_path)
+                areas = process_areas(areas, transforms, hazard_transforms, data_path, num_workers)
                 # areas.to_file(out_fname, driver="GPKG", layer="areas")
                 areas.to_parquet(pq_fname_areas)
 
@@ -99,10 +102,44 @@ def main(data_path, networks_csv, hazards_csv,output_path):
 Transform = namedtuple('Transform', ['crs', 'width', 'height', 'transform'])
 
 
-def associate_raster(df, key, fname, cell_index_col='cell_index', band_number=1):
-    with rasterio.open(fname) as dataset:
-        band_data = dataset.read(band_number)
-        df[key] = df[cell_index_col].apply(lambda i: band_data[i[1], i[0]])
+def sample_rasters(fnames, x, y, band_number=1):
+    """Read the values of rasters that share a transform at arrays of cell indices
+
+    Only the window bounding the cells is read from each raster,
+    and the values of all the cells are gathered in one array lookup
+    """
+    if len(x) == 0:
+        values = []
+        for fname in fnames:
+            with rasterio.open(fname) as dataset:
+                values.append(numpy.empty(0, dtype=dataset.dtypes[band_number - 1]))
+        return values
+
+    col_off, row_off = x.min(), y.min()
+    window = Window(col_off, row_off, x.max() - col_off + 1, y.max() - row_off + 1)
+    x = x - col_off
+    y = y - row_off
+    values = []
+    for fname in fnames:
+        with rasterio.open(fname) as dataset:
+            band_data = dataset.read(band_number, window=window)
+        values.append(band_data[y, x])
+    return values
+
+
+def associate_rasters(df, hazard_transforms, data_path):
+    """Add the values of all hazards to a dataframe, reading the hazards of each transform in one pass"""
+    hazard_values = {}
+    for transform_id, hazards in hazard_transforms.groupby('transform_id', sort=False):
+        logging.info("Hazards %s transform %s", len(hazards.index), transform_id)
+        cell_index_col = f'cell_index_{transform_id}'
+        fnames = [os.path.join(data_path, path) for path in hazards.path]
+        values = sample_rasters(fnames, df[f'{cell_index_col}_x'].values, df[f'{cell_index_col}_y'].values)
+        hazard_values.update(zip(hazards.key, values))
+    hazard_values = pandas.DataFrame(hazard_values, index=df.index)
+    hazard_values = hazard_values[[k for k in hazard_transforms.key if k in hazard_values.columns]]
+    df = pandas.concat([df.drop(columns=hazard_values.columns, errors='ignore'), hazard_values], axis=1)
+    return geopandas.GeoDataFrame(df, crs=df.crs, geometry='geometry')
 
 
 def read_transforms(hazards, data_path):
@@ -141,27 +178,18 @@ def read_transforms(hazards, data_path):
     return hazard_transforms, transforms
 
 
-def process_nodes(nodes, transforms, hazard_transforms, data_path):
+def process_nodes(nodes, transforms, hazard_transforms, data_path, num_workers=1):
     # lookup per transform
     for i, t in enumerate(transforms):
         # transform to grid
         crs_df = nodes.to_crs(t.crs)
         # save cell index for fast lookup of raster values
-        crs_df[f'cell_index_{i}'] = crs_df.geometry.progress_apply(lambda geom: get_indices(geom, t))
+        crs_df = split_df_parallel(crs_df, t, f'cell_index_{i}', None, num_workers)
         # transform back
         nodes = crs_df.to_crs(nodes.crs)
 
     # associate hazard values
-    for hazard in hazard_transforms.itertuples():
-        logging.info("Hazard %s transform %s", hazard.key, hazard.transform_id)
-        fname = os.path.join(data_path, hazard.path)
-        cell_index_col = f'cell_index_{hazard.transform_id}'
-        associate_raster(nodes, hazard.key, fname, cell_index_col)
-
-    # split and drop tuple columns so GPKG can save
-    for i, t in enumerate(transforms):
-        nodes = split_index_column(nodes, f'cell_index_{i}')
-        nodes.drop(columns=f'cell_index_{i}', inplace=True)
+    nodes = associate_rasters(nodes, hazard_transforms, data_path)
     return nodes
 
 
@@ -171,7 +199,7 @@ def try_merge(geom):
     return geom
 
 
-def process_edges(edges, transforms, hazard_transforms, data_path):
+def process_edges(edges, transforms, hazard_transforms, data_path, num_workers=1):
     # handle multilinestrings
     edges.geometry = edges.geometry.apply(try_merge)
     geom_types = edges.geometry.apply(lambda g: g.geom_type)
@@ -182,23 +210,13 @@ def process_edges(edges, transforms, hazard_transforms, data_path):
     for i, t in enumerate(transforms):
         # transform to grid
         crs_df = edges.to_crs(t.crs)
-        crs_df = split_df(crs_df, t)
-        # save cell index for fast lookup of raster values
-        crs_df[f'cell_index_{i}'] = crs_df.geometry.progress_apply(lambda geom: get_indices(geom, t))
+        # split in spatial chunks and save cell index for fast lookup of raster values
+        crs_df = split_df_parallel(crs_df, t, f'cell_index_{i}', split_df, num_workers)
         # transform back
         edges = crs_df.to_crs(edges.crs)
 
     # associate hazard values
-    for hazard in hazard_transforms.itertuples():
-        logging.info("Hazard %s transform %s", hazard.key, hazard.transform_id)
-        fname = os.path.join(data_path, hazard.path)
-        cell_index_col = f'cell_index_{hazard.transform_id}'
-        associate_raster(edges, hazard.key, fname, cell_index_col)
-
-    # split and drop tuple columns so GPKG can save
-    for i, t in enumerate(transforms):
-        edges = split_index_column(edges, f'cell_index_{i}')
-        edges.drop(columns=f'cell_index_{i}', inplace=True)
+    edges = associate_rasters(edges, hazard_transforms, data_path)
 
     return edges
 
@@ -225,28 +243,18 @@ def split_df(df, t):
     return sdf
 
 
-def process_areas(areas, transforms, hazard_transforms, data_path):
+def process_areas(areas, transforms, hazard_transforms, data_path, num_workers=1):
     # split areas per transform
     for i, t in enumerate(transforms):
         # transform to grid
         crs_df = areas.to_crs(t.crs)
-        crs_df = split_area_df(crs_df, t)
-        # save cell index for fast lookup of raster values
-        crs_df[f'cell_index_{i}'] = crs_df.geometry.progress_apply(lambda geom: get_indices(geom, t))
+        # split in spatial chunks and save cell index for fast lookup of raster values
+        crs_df = split_df_parallel(crs_df, t, f'cell_index_{i}', split_area_df, num_workers)
         # transform back
         areas = crs_df.to_crs(areas.crs)
 
     # associate hazard values
-    for hazard in hazard_transforms.itertuples():
-        logging.info("Hazard %s transform %s", hazard.key, hazard.transform_id)
-        fname = os.path.join(data_path, hazard.path)
-        cell_index_col = f'cell_index_{hazard.transform_id}'
-        associate_raster(areas, hazard.key, fname, cell_index_col)
-
-    # split and drop tuple columns so GPKG can save
-    for i, t in enumerate(transforms):
-        areas = split_index_column(areas, f'cell_index_{i}')
-        areas.drop(columns=f'cell_index_{i}', inplace=True)
+    areas = associate_rasters(areas, hazard_transforms, data_path)
 
     return areas
 
@@ -307,6 +315,58 @@ def split_area_df(df, t):
     return sdf
 
 
+def partition_df(df, num_chunks):
+    """Partition a GeoDataFrame into spatially compact chunks
+
+    Geometries are sorted into equal count strips by the x of their bounding box centres,
+    and by y within each strip, before the sorted rows are cut into chunks
+    """
+    if num_chunks <= 1 or len(df.index) <= num_chunks:
+        return [df]
+    bounds = df.geometry.bounds
+    x = 0.5*(bounds.minx.values + bounds.maxx.values)
+    y = 0.5*(bounds.miny.values + bounds.maxy.values)
+    num_strips = int(numpy.ceil(numpy.sqrt(num_chunks)))
+    strip = numpy.argsort(numpy.argsort(x, kind='stable'), kind='stable')*num_strips // len(x)
+    order = numpy.lexsort((y, strip))
+    return [df.iloc[chunk] for chunk in numpy.array_split(order, num_chunks)]
+
+
+def split_chunk(df, t, split_function=None):
+    """Split the geometries of a chunk along the grid of a transform and find their cell indices"""
+    if split_function is not None:
+        df = split_function(df, t)
+    cell_indices = numpy.array([get_indices(geom, t) for geom in df.geometry], dtype='int64').reshape(-1, 2)
+    return df.assign(cell_index_x=cell_indices[:, 0], cell_index_y=cell_indices[:, 1])
+
+
+def split_df_parallel(df, t, cell_index_col, split_function=None, num_workers=1):
+    """Split geometries along the grid of a transform and add the cell indices of the splits
+    as integer x and y columns with the prefix cell_index_col
+
+    The network is partitioned into spatial chunks, which are split on a pool of worker processes
+    and concatenated. Several chunks are made per worker to balance the load across regions
+    with dense and sparse networks.
+    """
+    if num_workers > 1:
+        chunks = partition_df(df, 4*num_workers)
+    else:
+        chunks = [df]
+    if len(chunks) == 1:
+        sdf = split_chunk(df, t, split_function)
+    else:
+        logging.info(f"Splitting {len(df)} geometries in {len(chunks)} chunks on {num_workers} workers")
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            splits = list(tqdm(
+                executor.map(split_chunk, chunks, repeat(t), repeat(split_function)),
+                total=len(chunks)))
+        sdf = geopandas.GeoDataFrame(
+            pandas.concat(splits, ignore_index=True), crs=splits[0].crs, geometry='geometry')
+    return sdf.rename(columns={
+        'cell_index_x': f'{cell_index_col}_x',
+        'cell_index_y': f'{cell_index_col}_y'})
+
+
 def get_indices(geom, t):
     x, y = get_cell_indices(
         geom,
@@ -319,12 +379,6 @@ def get_indices(geom, t):
     return (x, y)
 
 
-def split_index_column(df, prefix):
-    df[f'{prefix}_x'] = df[prefix].apply(lambda i: i[0])
-    df[f'{prefix}_y'] = df[prefix].apply(lambda i: i[1])
-    return df
-
-
 if __name__ == '__main__':
     # Load config
     CONFIG = load_config()
@@ -334,10 +388,11 @@ if __name__ == '__main__':
         networks_csv = sys.argv[1]
         hazards_csv = sys.argv[2]
         output_path = sys.argv[3]
+        num_workers = int(sys.argv[4]) if len(sys.argv) > 4 else os.cpu_count()
     except IndexError:
         logging.error(
             "Error. Please provide networks and hazards as CSV and an output path for results.\n",
-            f"Usage: python {__file__} networks/network_files.csv hazards/hazard_layers.csv output_path/")
+            f"Usage: python {__file__} networks/network_files.csv hazards/hazard_layers.csv output_path/ [num_workers]")
 
     # Ignore writing-to-parquet warnings
     warnings.filterwarnings('ignore', message='.*initial implementation of Parquet.*')
@@ -350,5 +405,5 @@ if __name__ == '__main__':
     # Enable info logging
     logging.basicConfig(format='%(asctime)s %(message)s', level=logging.INFO)
     logging.info("Start.")
-    main(data_path, networks_csv, hazards_csv)
+    main(data_path, networks_csv, hazards_csv, output_path, num_workers)
     logging.info("Done.")
@@ -98,95 +98,6 @@ def network_od_paths_assembly(points_dataframe, graph,
 
     return save_paths_df
 
-def network_od_path_estimations(graph,
-    source, target, cost_criteria):
-    """Estimate the paths, distances, times, and costs for given OD pair
-
-    Parameters
-    ---------
-    graph
-        igraph network structure
-    source
-        String/Float/Integer name of Origin node ID
-    source
-        String/Float/Integer name of Destination node ID
-    tonnage : float
-        value of tonnage
-    vehicle_weight : float
-        unit weight of vehicle
-    cost_criteria : str
-        name of generalised cost criteria to be used: min_gcost or max_gcost
-    time_criteria : str
-        name of time criteria to be used: min_time or max_time
-    fixed_cost : bool
-
-    Returns
-    -------
-    edge_path_list : list[list]
-        nested lists of Strings/Floats/Integers of edge ID's in routes
-    path_dist_list : list[float]
-        estimated distances of routes
-    path_time_list : list[float]
-        estimated times of routes
-    path_gcost_list : list[float]
-        estimated generalised costs of routes
-
-    """
-    paths = graph.get_shortest_paths(source, target, weights=cost_criteria, output="epath")
-
-
-    edge_path_list = []
-    path_gcost_list = []
-    # for p in range(len(paths)):
-    for path in paths:
-        edge_path = []
-        path_gcost = 0
-        if path:
-            for n in path:
-                edge_path.append(graph.es[n]['edge_id'])
-                path_gcost += graph.es[n][cost_criteria]
-
-        edge_path_list.append(edge_path)
-        path_gcost_list.append(path_gcost)
-
-    
-    return edge_path_list, path_gcost_list
-
-def get_flow_on_edges(save_paths_df,edge_id_column,edge_path_column,
-    flow_column):
-    """Write results to Shapefiles
-
-    Outputs ``gdf_edges`` - a shapefile with minimum and maximum tonnage flows of all
-    commodities/industries for each edge of network.
-
-    Parameters
-    ---------
-    save_paths_df
-        Pandas DataFrame of OD flow paths and their tonnages
-    industry_columns
-        List of string names of all OD commodities/industries indentified
-    min_max_exist
-        List of string names of commodity/industry columns for which min-max tonnage column names already exist
-    gdf_edges
-        GeoDataFrame of network edge set
-    save_csv
-        Boolean condition to tell code to save created edge csv file
-    save_shapes
-        Boolean condition to tell code to save created edge shapefile
-    shape_output_path
-        Path where the output shapefile will be stored
-    csv_output_path
-        Path where the output csv file will be stored
-
-    """
-    edge_flows = defaultdict(float)
-    for row in save_paths_df.itertuples():
-        for item in getattr(row,edge_path_column):
-            edge_flows[item] += getattr(row,flow_column)
-
-    return pd.DataFrame([(k,v) for k,v in edge_flows.items()],columns=[edge_id_column,flow_column])
-
-
 def main(config):
     incoming_data_path = config['paths']['incoming_data']
     processed_data_path = config['paths']['data']
@@ -271,20 +182,15 @@ def main(config):
     network_edges = edges[network_columns]
     print (network_edges)
 
-    G = ig.Graph.TupleList(network_edges.itertuples(index=False), edge_attrs=list(network_edges.columns)[2:])
+    G, _ = network_graph_from_dataframe(network_edges,edge_attributes=list(network_edges.columns)[2:])
     
     save_paths = []
     flow_paths = network_od_paths_assembly(od_pairs,G,
                                 "max_flow_cost","tonnage")
     flow_paths.to_csv(os.path.join(results_data_path,"flow_paths","all_flow_paths.csv"), index=False)
 
-    edge_tonnages = get_flow_on_edges(flow_paths,"edge_id","edge_path",
-                                                    "tonnage")
-    edge_values = get_flow_on_edges(flow_paths,"edge_id","edge_path",
-                                                    "value_usd")
-
-    edge_flows = pd.merge(edge_tonnages,edge_values,how="left",on=["edge_id"]).fillna(0)
-    del edge_tonnages,edge_values
+    edge_flows = get_flow_on_edges(flow_paths,"edge_id","edge_path",
+                                                    ["tonnage","value_usd"])
     edges = pd.merge(edges,edge_flows,how="left",on=["edge_id"]).fillna(0)
     edges.to_file(os.path.join(results_data_path,
                                 "flow_paths",
@@ -7,6 +7,9 @@ import warnings
 import geopandas as gpd
 import pandas as pd
 import numpy
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 import warnings
 
 def load_config():
@@ -94,9 +97,19 @@ def main(config):
                 with open("parameter_combinations.txt","r") as r:
                     for p in r:
                         pv = p.strip("\n").split(",")
-                        df = pd.read_csv(os.path.join(results_data_path,
+                        if damage == "EAD_EAEL":
+                            # The EAD and EAEL of each parameter set are in their own folder of the dataset
+                            df = pq.read_table(os.path.join(results_data_path,
                                                 damage_results_folder,
-                                                f"{sector}_{damage}_parameter_set_{pv[0]}.csv"))
+                                                f"{sector}_{damage}",
+                                                f"parameter_set={pv[0]}"),
+                                            partitioning=ds.partitioning(
+                                                pa.schema([(c,pa.string()) for c in ["hazard","rcp","epoch"]]),
+                                                flavor="hive")).to_pandas()
+                        else:
+                            df = pd.read_parquet(os.path.join(results_data_path,
+                                                damage_results_folder,
+                                                f"{sector}_{damage}_parameter_set_{pv[0]}.parquet"))
                         df["cost_uncertainty_parameter"] = pv[1]
                         df["damage_uncertainty_parameter"] = pv[2]
                         if damage in ["direct_damages","economic_losses"]: